@@ -3,18 +3,45 @@
 #----------------------------------------------------------------------------#
 
 import json
+import hashlib
+from datetime import datetime, timedelta
+import base64
+import itertools
+from itertools import groupby
+from functools import lru_cache
+import time
+import random
+from math import cos, radians
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort
+import babel.dates
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort, session
+from werkzeug.http import is_resource_modified
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy.dialects.postgresql import ARRAY, TSVECTOR
+from sqlalchemy import exc
 import logging
-from logging import Formatter, FileHandler
+from logging import Formatter
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+import queue
+import atexit
+import gzip
+import shutil
+import os
 from flask_wtf import Form
 from flask_wtf import FlaskForm
 from flask_migrate import Migrate
 from forms import *
+from cache import PageCache, MemoryBackend, FragmentCacheExtension, venue_key, artist_key
+from autocomplete import PrefixIndex
+import importer
+import geo
+import bench
+from metrics import Metrics
+from replicas import RoutingSQLAlchemy
 import sys
+import click
 import config
 #----------------------------------------------------------------------------#
 # App Config.
@@ -23,8 +50,18 @@ import config
 app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
-db = SQLAlchemy(app)
+db = RoutingSQLAlchemy(app)
 migrate = Migrate(app, db)
+page_cache = PageCache.from_config(app.config)
+metrics = Metrics()
+metrics.init_app(app)
+name_index = PrefixIndex(app.config['AUTOCOMPLETE_MAX_AGE'], app.logger)
+# compiled templates are kept on disk, so a fresh worker loads bytecode
+# instead of compiling templates/ again
+os.makedirs(app.config['TEMPLATE_CACHE_DIR'], exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])
+app.jinja_env.add_extension(FragmentCacheExtension)
+app.jinja_env.fragment_cache = MemoryBackend(app.config['FRAGMENT_CACHE_SIZE'])
 
 
 # app.config['SQLQLCHEMY_TRACK_MODIFICATIONS'] = False
@@ -50,8 +87,29 @@ class Venue(db.Model):
     website_link = db.Column(db.String(255))
     seeking_talent = db.Column(db.Boolean)
     seeking_talent_text = db.Column(db.String(255))
-    genres = db.Column(db.String(120))
-    shows = db.relationship('Show', backref='venue', lazy=True)
+    genres = db.Column(ARRAY(db.String(120)))
+    shows = db.relationship('Show', backref='venue', lazy=True, order_by='Show.start_time', passive_deletes=True)
+    search_vector = db.Column(TSVECTOR, db.Computed("to_tsvector('simple', coalesce(name, ''))", persisted=True))
+    # kept up to date by triggers on Show; see refresh-upcoming-counts
+    num_upcoming_shows = db.Column(db.Integer, nullable=False, server_default='0')
+    # Last-Modified of the API resource: set on every edit and by touch()
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False,
+                           server_default=db.func.now(), onupdate=db.func.now())
+    # filled in from a gazetteer by geocode-venues; geohash is the index key
+    # for nearby searches, under the C collation so prefixes are key ranges
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(geo.PRECISION, collation='C'))
+
+    __table_args__ = (
+        # state is optional; the page key reads a missing state as ''
+        db.Index('ix_Venue_state_city_name_id', db.func.coalesce(state, ''), 'city', 'name', 'id'),
+        db.Index('ix_Venue_name_id', 'name', 'id'),
+        db.Index('ix_Venue_geohash', 'geohash'),
+        db.Index('ix_Venue_genres', 'genres', postgresql_using='gin'),
+        db.Index('ix_Venue_search_vector', 'search_vector', postgresql_using='gin'),
+        db.Index('ix_Venue_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+    )
 
     # PS
     def __repr__(self):
@@ -67,14 +125,27 @@ class Artist(db.Model):
     city = db.Column(db.String(120), nullable=False)
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.String(120))
+    genres = db.Column(ARRAY(db.String(120)))
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(255))
     #PS
     website_link = db.Column(db.String(500))
     seeking_venue = db.Column(db.Boolean)
     seeking_venue_text = db.Column(db.String(255))
-    shows = db.relationship('Show', backref='artist', lazy=True)
+    shows = db.relationship('Show', backref='artist', lazy=True, order_by='Show.start_time', passive_deletes=True)
+    search_vector = db.Column(TSVECTOR, db.Computed("to_tsvector('simple', coalesce(name, ''))", persisted=True))
+    # kept up to date by triggers on Show; see refresh-upcoming-counts
+    num_upcoming_shows = db.Column(db.Integer, nullable=False, server_default='0')
+    # Last-Modified of the API resource: set on every edit and by touch()
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False,
+                           server_default=db.func.now(), onupdate=db.func.now())
+
+    __table_args__ = (
+        db.Index('ix_Artist_name_id', 'name', 'id'),
+        db.Index('ix_Artist_genres', 'genres', postgresql_using='gin'),
+        db.Index('ix_Artist_search_vector', 'search_vector', postgresql_using='gin'),
+        db.Index('ix_Artist_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+    )
    
     # PS
     def __repr__(self):
@@ -90,25 +161,486 @@ class Show(db.Model):
     __tablename__ = 'Show'
 
     id = db.Column(db.Integer, primary_key=True)
-    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
-    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), nullable=False)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), nullable=False)
     start_time = db.Column(db.DateTime, nullable=False)
+    # a show takes up [start_time, end_time); the show_no_overlap trigger
+    # rejects bookings overlapping another show at the venue or of the artist
+    end_time = db.Column(db.DateTime, nullable=False)
+
+    # every timeline, count and search filters on one side of the show plus start_time
+    __table_args__ = (
+        db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+        db.Index('ix_Show_start_time_id', 'start_time', 'id'),
+        db.CheckConstraint('end_time > start_time', name='Show_end_after_start'),
+    )
 
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
+@lru_cache(maxsize=None)
+def datetime_pattern(format, locale):
+  # compiled once per format and locale instead of on every call
+  return babel.dates.parse_pattern(format), babel.Locale.parse(locale)
+
 def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
+  # views hand over datetime objects; strings are still accepted but parsed
+  if not isinstance(value, datetime):
+    value = dateutil.parser.parse(value)
   if format == 'full':
       format="EEEE MMMM, d, y 'at' h:mma"
   elif format == 'medium':
       format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format)
+  pattern, locale = datetime_pattern(format, babel.dates.LC_TIME)
+  return pattern.apply(value, locale)
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+#----------------------------------------------------------------------------#
+# Search.
+#----------------------------------------------------------------------------#
+
+SEARCH_LIMIT = 50
+# a term matching more names than this is too broad to rank usefully
+SEARCH_CANDIDATES = 500
+
+def search_by_name(model, search_term, offset=0):
+  """Return (rows, next_offset, total) for one page of name matches.
+
+  next_offset is None on the last page; total is None when more than
+  SEARCH_CANDIDATES names match. The ILIKE keeps the partial,
+  case-insensitive matching and is answered by the name_trgm GIN index.
+  Up to SEARCH_CANDIDATES matches are fetched with their ranks, and
+  whole-word hits rank above plain substring hits. A broader term, such as
+  "the" or a single letter, is listed by name instead, walking the (name, id)
+  index and stopping after the page, so no request ranks a large share of
+  the table. Upcoming shows come from the maintained num_upcoming_shows counter.
+  """
+  words = db.func.plainto_tsquery('simple', search_term)
+  matches = db.session.query(model.id, model.name, model.num_upcoming_shows, model.updated_at) \
+    .filter(model.name.ilike('%' + search_term + '%'))
+  candidates = matches.add_columns(db.func.ts_rank(model.search_vector, words).label('rank'),
+                                   db.func.similarity(model.name, search_term).label('similarity')) \
+    .limit(SEARCH_CANDIDATES + 1).all()
+  if len(candidates) <= SEARCH_CANDIDATES:
+    total = len(candidates)
+    candidates.sort(key=lambda row: (-row.rank, -row.similarity, row.name, row.id))
+    rows = candidates[offset:offset + SEARCH_LIMIT + 1]
+  else:
+    total = None
+    rows = matches.order_by(model.name, model.id).offset(offset).limit(SEARCH_LIMIT + 1).all()
+  if len(rows) <= SEARCH_LIMIT:
+    return rows, None, total
+  return rows[:SEARCH_LIMIT], offset + SEARCH_LIMIT, total
+
+def autocomplete_names():
+  # every (kind, id, name) the autocomplete index is built from
+  venues = db.session.query(db.literal('venue'), Venue.id, Venue.name)
+  artists = db.session.query(db.literal('artist'), Artist.id, Artist.name)
+  return venues.union_all(artists)
+
+def load_autocomplete_names():
+  # runs on the index's rebuild thread: outside any request, so it reads
+  # from the primary rather than a replica that may lag
+  with app.app_context():
+    return autocomplete_names().all()
+
+def venues_in_box(west, south, east, north):
+  """Query venues inside a box, as found through the geohash index.
+
+  Each covering geohash prefix is one range scan on ix_Venue_geohash; the
+  coordinates then trim the cells' overhang. west > east crosses the antimeridian.
+  """
+  cells = [db.and_(Venue.geohash >= low, Venue.geohash < high)
+           for low, high in map(geo.key_range, geo.cover(west, south, east, north))]
+  if west <= east:
+    longitude = Venue.longitude.between(west, east)
+  else:
+    longitude = db.or_(Venue.longitude >= west, Venue.longitude <= east)
+  return db.session.query(Venue.id, Venue.name, Venue.city, Venue.state, Venue.latitude, Venue.longitude) \
+    .filter(db.or_(*cells), Venue.latitude.between(south, north), longitude)
+
+def distance_from(latitude, longitude):
+  # geo.distance_km from a point to Venue's coordinates, as SQL, so candidates
+  # are filtered, sorted and cut to a page in the database
+  lat, lng = db.func.radians(Venue.latitude), db.func.radians(Venue.longitude)
+  a = db.func.power(db.func.sin((lat - radians(latitude)) / 2), 2) + \
+      cos(radians(latitude)) * db.func.cos(lat) * db.func.power(db.func.sin((lng - radians(longitude)) / 2), 2)
+  # least() keeps rounding from taking asin out of its domain
+  return 2 * geo.EARTH_RADIUS_KM * db.func.asin(db.func.least(1.0, db.func.sqrt(a)))
+
+#----------------------------------------------------------------------------#
+# Pagination.
+#----------------------------------------------------------------------------#
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+def page_limit():
+  limit = request.args.get('limit', PAGE_SIZE, type=int)
+  return max(1, min(limit, MAX_PAGE_SIZE))
+
+def encode_cursor(values):
+  return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+def decode_cursor(cursor, key):
+  # a cursor is client input: anything that does not fit the key columns is a
+  # 400 here rather than a DataError from Postgres
+  try:
+    values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+  except ValueError:
+    abort(400)
+  if not isinstance(values, list) or len(values) != len(key):
+    abort(400)
+  return [cursor_value(column.type.python_type, value) for column, value in zip(key, values)]
+
+def cursor_value(python_type, value):
+  if python_type is datetime and isinstance(value, str):
+    try:
+      return datetime.fromisoformat(value)
+    except ValueError:
+      abort(400)
+  # type() rather than isinstance(), so True is not taken for an id
+  if type(value) is not python_type:
+    abort(400)
+  if python_type is int and not -2**31 <= value < 2**31:
+    abort(400)
+  if python_type is str and '\x00' in value:
+    abort(400)
+  return value
+
+def paginate(query, key, cursor_of):
+  """Return one keyset page of query, ordered by the key columns.
+
+  The page starts after the ?after= cursor, so a deep page is the same index
+  range scan as the first one. Returns (rows, next_cursor); next_cursor is
+  None on the last page.
+  """
+  limit = page_limit()
+  after = request.args.get('after')
+  rows = keyset_page(query, key, decode_cursor(after, key) if after else None, limit).all()
+  if len(rows) <= limit:
+    return rows, None
+  rows = rows[:limit]
+  return rows, encode_cursor(cursor_of(rows[-1]))
+
+def keyset_page(query, key, after, limit):
+  # one row more than the page, to tell whether another page follows
+  if after is not None:
+    query = query.filter(db.tuple_(*key) > db.tuple_(*after))
+  return query.order_by(*key).limit(limit + 1)
+
+@app.template_global()
+def next_page_url(cursor):
+  # the current listing URL, filters included, moved on to the next page
+  args = request.args.to_dict()
+  args['after'] = cursor
+  return url_for(request.endpoint, **args)
+
+#----------------------------------------------------------------------------#
+# Show schedule.
+#----------------------------------------------------------------------------#
+
+def date_arg(name, through_day=False):
+  # with through_day, a bare date such as the form's date inputs send stands
+  # for the end of that day, so ?to=2021-01-08 keeps the shows on the 8th
+  value = request.args.get(name)
+  if not value:
+    return None
+  if through_day:
+    try:
+      return datetime.strptime(value.strip(), '%Y-%m-%d') + timedelta(days=1)
+    except ValueError:
+      pass
+  try:
+    return dateutil.parser.parse(value)
+  except (ValueError, OverflowError):
+    abort(400)
+
+def shows_in_window(query, start=None, end=None, city=None):
+  """Restrict a Show query joined to Venue to start_time in [start, end) and one city.
+
+  The start_time bounds are a range scan on ix_Show_start_time_id, so a week's
+  schedule reads a week of index entries however much history there is.
+  """
+  if start is not None:
+    query = query.filter(Show.start_time >= start)
+  if end is not None:
+    query = query.filter(Show.start_time < end)
+  if city:
+    query = query.filter(Venue.city == city)
+  return query
+
+#----------------------------------------------------------------------------#
+# Page cache.
+#----------------------------------------------------------------------------#
+
+def pages_of_venues(venue_ids):
+  # the venues' pages plus the page of every artist with a show at one of them
+  artist_ids = [row.artist_id for row in db.session.query(Show.artist_id).filter(Show.venue_id.in_(venue_ids)).distinct()]
+  return {'venue_ids': venue_ids, 'artist_ids': artist_ids}
+
+def pages_of_artists(artist_ids):
+  venue_ids = [row.venue_id for row in db.session.query(Show.venue_id).filter(Show.artist_id.in_(artist_ids)).distinct()]
+  return {'venue_ids': venue_ids, 'artist_ids': artist_ids}
+
+def touch(venue_ids=(), artist_ids=()):
+  # moves updated_at, and with it the cached page's key, on venues and artists
+  # whose pages show something that changed; takes what pages_of_*() return
+  for model, ids in ((Venue, venue_ids), (Artist, artist_ids)):
+    if ids:
+      db.session.query(model).filter(model.id.in_(ids)) \
+        .update({model.updated_at: db.func.now()}, synchronize_session=False)
+
+# Postgres runs a data-modifying WITH query whether or not the main query
+# reads it, so the other side's pages are touched in the same statement. The
+# CTEs see the shows as they were before the cascade removes them.
+DELETE_AND_TOUCH = """
+WITH deleted AS (DELETE FROM "{table}" WHERE id = ANY(:ids) RETURNING id, name),
+touched AS (UPDATE "{other}" SET updated_at = now()
+            WHERE id IN (SELECT {other_id} FROM "Show" WHERE {own_id} IN (SELECT id FROM deleted)))
+SELECT id, name FROM deleted
+"""
+
+def delete_by_id(model, ids):
+  """Delete venues or artists in one statement and commit.
+
+  Returns (names, missing): the names of the deleted rows and the ids that
+  did not exist. Their shows go with them through ON DELETE CASCADE on Show.
+  """
+  if model is Venue:
+    sql = DELETE_AND_TOUCH.format(table='Venue', other='Artist', own_id='venue_id', other_id='artist_id')
+  else:
+    sql = DELETE_AND_TOUCH.format(table='Artist', other='Venue', own_id='artist_id', other_id='venue_id')
+  deleted = dict(db.session.execute(db.text(sql), {'ids': list(ids)}).fetchall())
+  db.session.commit()
+  for entity_id in deleted:
+    name_index.remove('venue' if model is Venue else 'artist', entity_id)
+  return list(deleted.values()), [entity_id for entity_id in ids if entity_id not in deleted]
+
+#----------------------------------------------------------------------------#
+# Page data.
+#----------------------------------------------------------------------------#
+
+# The dicts behind the listing and detail pages, shared by the HTML views and
+# the JSON API.
+
+def venue_areas():
+  # one query for a page of venues and their upcoming show counters, ordered
+  # so venues of the same city/state are adjacent and can be grouped in one
+  # pass. The page key keeps that order rather than (name, id) alone; a
+  # missing state is keyed as '', since a row comparison with NULL in it is
+  # never true and would strand those venues after the first page.
+  query = db.session.query(Venue.id, Venue.name, Venue.city, Venue.state, Venue.num_upcoming_shows, Venue.updated_at)
+  # ?genre=Jazz is a containment test answered by the genres GIN index
+  if request.args.get('genre'):
+    query = query.filter(Venue.genres.contains([request.args['genre']]))
+  rows, next_cursor = paginate(query, (db.func.coalesce(Venue.state, ''), Venue.city, Venue.name, Venue.id),
+                               lambda row: [row.state or '', row.city, row.name, row.id])
+  data=[]
+  for (city, state), venues_in_city in groupby(rows, key=lambda row: (row.city, row.state)):
+      data.append({
+        "city": city,
+        "state": state,
+        "venues": [{
+          "id": venue.id,
+          "name": venue.name,
+          "num_upcoming_shows": venue.num_upcoming_shows,
+          "updated_at": venue.updated_at
+        } for venue in venues_in_city]
+      })
+  return data, next_cursor
+
+def artist_list():
+  query = db.session.query(Artist.id, Artist.name, Artist.updated_at)
+  if request.args.get('genre'):
+    query = query.filter(Artist.genres.contains([request.args['genre']]))
+  artists, next_cursor = paginate(query, (Artist.name, Artist.id),
+                                  lambda artist: [artist.name, artist.id])
+  data = []
+  for artist in artists:
+    data.append({"id":artist.id, "name" : artist.name, "updated_at": artist.updated_at})
+  return data, next_cursor
+
+SHOW_KEY = (Show.start_time, Show.id)
+
+def show_listing(start=None, end=None, city=None):
+  return shows_in_window(db.session.query(Show,Artist,Venue).join(Artist,Venue), start, end, city)
+
+def show_list():
+  # ?from=2021-01-01&to=2021-01-08&city=Berlin narrows the listing to a window,
+  # both days included
+  query = show_listing(date_arg('from'), date_arg('to', through_day=True), request.args.get('city'))
+  shows, next_cursor = paginate(query, SHOW_KEY, lambda show: [show[0].start_time, show[0].id])
+  data=[]
+  for show in shows:
+    data.append({
+      "id": show[0].id,
+      "venue_id": show[2].id,
+      "venue_name": show[2].name,
+      "artist_id": show[1].id,
+      "artist_name": show[1].name,
+      "artist_image_link": show[1].image_link,
+      "start_time": show[0].start_time,
+      "artist_updated_at": show[1].updated_at,
+      "venue_updated_at": show[2].updated_at
+    })
+  return data, next_cursor
+
+def timeline_columns():
+  """Label each show 'past' or 'upcoming' by the database clock, with the size of its list.
+
+  A show is upcoming while start_time > now(), the test the upcoming show
+  counters use too, so every show lands in exactly one list.
+  """
+  timeline = db.case([(Show.start_time > db.func.now(), 'upcoming')], else_='past')
+  return timeline.label('timeline'), db.func.count(Show.id).over(partition_by=timeline).label('timeline_count')
+
+# the entity's columns repeat on every show row, so only the ones the page
+# shows are loaded, and never search_vector or the geohash
+VENUE_PAGE_COLUMNS = ('name', 'genres', 'address', 'city', 'state', 'phone', 'website_link', 'facebook_link',
+                      'seeking_talent', 'seeking_talent_text', 'image_link')
+ARTIST_PAGE_COLUMNS = ('name', 'genres', 'city', 'state', 'phone', 'website_link', 'facebook_link',
+                       'seeking_venue', 'seeking_venue_text', 'image_link')
+
+def venue_timeline(venue_id):
+  # the venue and its whole timeline, labelled, counted and ordered, in one query
+  return db.session.query(Venue, Show.start_time, Artist.id.label('other_id'),
+                          Artist.name.label('other_name'), Artist.image_link.label('other_image_link'),
+                          *timeline_columns()) \
+    .options(db.load_only(*VENUE_PAGE_COLUMNS)) \
+    .outerjoin(Show, Show.venue_id == Venue.id).outerjoin(Artist, Artist.id == Show.artist_id) \
+    .filter(Venue.id == venue_id).order_by(Show.start_time)
+
+def artist_timeline(artist_id):
+  return db.session.query(Artist, Show.start_time, Venue.id.label('other_id'),
+                          Venue.name.label('other_name'), Venue.image_link.label('other_image_link'),
+                          *timeline_columns()) \
+    .options(db.load_only(*ARTIST_PAGE_COLUMNS)) \
+    .outerjoin(Show, Show.artist_id == Artist.id).outerjoin(Venue, Venue.id == Show.venue_id) \
+    .filter(Artist.id == artist_id).order_by(Show.start_time)
+
+def page_version(model, entity_id):
+  # a cached page is keyed on this; a missing row is a 404 before any cache lookup
+  version = db.session.query(model.updated_at).filter(model.id == entity_id).scalar()
+  if version is None:
+    abort(404)
+  return version
+
+def resource_version(model, entity_id):
+  """Return (etag, last_modified) of a venue's or artist's API resource, or abort with 404.
+
+  Everything the resource holds moves one of two values: edits and bookings
+  move updated_at (see touch()), and time moves the latest show that has
+  started from upcoming to past. Both are index lookups, so a conditional GET
+  is answered without reading the timeline.
+  """
+  show_key = Show.venue_id if model is Venue else Show.artist_id
+  last_started = db.session.query(db.func.max(Show.start_time)) \
+    .filter(show_key == model.id, Show.start_time <= db.func.now()).correlate(model).as_scalar()
+  row = db.session.query(model.updated_at, last_started.label('last_started')).filter(model.id == entity_id).first()
+  if row is None:
+    abort(404)
+  version = f'{model.__tablename__}:{entity_id}:{row.updated_at.isoformat()}:{row.last_started}'
+  last_modified = row.updated_at
+  if row.last_started is not None:
+    last_modified = max(last_modified, row.last_started.astimezone())
+  return hashlib.sha256(version.encode()).hexdigest(), last_modified
+
+def venue_details(venue_id):
+  """Return (data, expires) for a venue's page, or abort with 404.
+
+  expires is the start of the first upcoming show.
+  """
+  rows = venue_timeline(venue_id).all()
+  if not rows:
+    abort(404)
+  venue = rows[0].Venue
+  data={
+    "id": venue.id,
+    "name": venue.name,
+    "genres": venue.genres,
+    "address": venue.address,
+    "city": venue.city,
+    "state": venue.state,
+    "phone": venue.phone,
+    "website_link": venue.website_link,
+    "facebook_link": venue.facebook_link,
+    "seeking_talent": venue.seeking_talent,
+    "seeking_talent_text": venue.seeking_talent_text,
+    "image_link": venue.image_link
+  }
+
+  shows = {"past": [], "upcoming": []}
+  counts = {"past": 0, "upcoming": 0}
+  # the page is stale once its first upcoming show starts
+  expires = None
+  for row in rows:
+    # a lone row without a show stands for an empty timeline
+    if row.start_time is None:
+      continue
+    shows[row.timeline].append({
+      "artist_id": row.other_id,
+      "artist_name": row.other_name,
+      "artist_image_link": row.other_image_link,
+      "start_time": row.start_time
+    })
+    counts[row.timeline] = row.timeline_count
+    if row.timeline == 'upcoming' and expires is None:
+      expires = row.start_time
+
+  data["past_shows"] = shows["past"]
+  data["upcoming_shows"] = shows["upcoming"]
+  data["past_shows_count"] = counts["past"]
+  data["upcoming_shows_count"] = counts["upcoming"]
+  return data, expires
+
+def artist_details(artist_id):
+  """Return (data, expires) for an artist's page, or abort with 404."""
+  rows = artist_timeline(artist_id).all()
+  if not rows:
+    abort(404)
+  artist = rows[0].Artist
+  data={
+    "id": artist.id,
+    "name": artist.name,
+    "genres": artist.genres,
+    "city": artist.city,
+    "state": artist.state,
+    "phone": artist.phone,
+    "website_link": artist.website_link,
+    "facebook_link": artist.facebook_link,
+    "seeking_venue": artist.seeking_venue,
+    "seeking_venue_text": artist.seeking_venue_text,
+    "image_link": artist.image_link
+  }
+  shows = {"past": [], "upcoming": []}
+  counts = {"past": 0, "upcoming": 0}
+  # the page is stale once its first upcoming show starts
+  expires = None
+  for row in rows:
+    # a lone row without a show stands for an empty timeline
+    if row.start_time is None:
+      continue
+    shows[row.timeline].append({
+      "venue_id": row.other_id,
+      "venue_name": row.other_name,
+      "venue_image_link": row.other_image_link,
+      "start_time": row.start_time
+    })
+    counts[row.timeline] = row.timeline_count
+    if row.timeline == 'upcoming' and expires is None:
+      expires = row.start_time
+
+  data["past_shows"] = shows["past"]
+  data["upcoming_shows"] = shows["upcoming"]
+  data["past_shows_count"] = counts["past"]
+  data["upcoming_shows_count"] = counts["upcoming"]
+  return data, expires
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
@@ -118,6 +650,24 @@ def index():
   return render_template('pages/home.html')
 
 
+#  Autocomplete
+#  ----------------------------------------------------------------
+
+AUTOCOMPLETE_FIRST_BUILD_WAIT = 10
+
+@app.route('/autocomplete')
+def autocomplete():
+  # ?q=mus → venues and artists with a word in their name starting with "mus",
+  # answered from name_index without a query; only a worker's first request
+  # waits for the index to be built
+  name_index.refresh(load_autocomplete_names)
+  name_index.ready.wait(AUTOCOMPLETE_FIRST_BUILD_WAIT)
+  query = request.args.get('q', '').strip()
+  limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+  matches = name_index.search(query, limit) if query else []
+  return {"data": [{"type": kind, "id": entity_id, "name": name} for kind, entity_id, name in matches]}
+
+
 #  Venues
 #  ----------------------------------------------------------------
 
@@ -127,17 +677,8 @@ def venues():
   #       num_shows should be aggregated based on number of upcoming shows per venue.
   
   #PS
-  data=[]
-  cities = db.session.query(Venue.city, Venue.state).distinct(Venue.city, Venue.state)
-
-  for city in cities:
-      venues_in_city = db.session.query(Venue.id, Venue.name).filter(Venue.city == city[0]).filter(Venue.state == city[1])
-      data.append({
-        "city": city[0],
-        "state": city[1],
-        "venues": venues_in_city
-      })
-  return render_template('pages/venues.html', areas=data)
+  areas, next_cursor = venue_areas()
+  return render_template('pages/venues.html', areas=areas, next_cursor=next_cursor)
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
@@ -147,25 +688,21 @@ def search_venues():
 
   #PS
   search_term = request.form.get('search_term', '')
-  venues = db.session.query(Venue).filter(Venue.name.ilike('%' + search_term + '%')).all()
+  venues, next_offset, total = search_by_name(Venue, search_term, max(0, request.form.get('offset', 0, type=int)))
   data = []
 
   for venue in venues:
-      num_upcoming_shows = 0
-      shows = db.session.query(Show).filter(Show.venue_id == venue.id)
-      for show in shows:
-          if (show.start_time > datetime.now()):
-              num_upcoming_shows += 1
-
       data.append({
         "id": venue.id,
         "name": venue.name,
-        "num_upcoming_shows": num_upcoming_shows
+        "num_upcoming_shows": venue.num_upcoming_shows,
+        "updated_at": venue.updated_at
       })
 
   response={
-        "count": len(venues),
-        "data": data
+        "count": total if total is not None else f'more than {SEARCH_CANDIDATES}',
+        "data": data,
+        "next_offset": next_offset
     }
 
   return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
@@ -176,51 +713,21 @@ def show_venue(venue_id):
   # TODO: replace with real venue data from the venues table, using venue_id
 
   #PS
-  venue = Venue.query.get(venue_id)
-  data={
-    "id": venue.id,
-    "name": venue.name,
-    "genres": venue.genres,
-    "address": venue.address,
-    "city": venue.city,
-    "state": venue.state,
-    "phone": venue.phone,
-    "website_link": venue.website_link,
-    "facebook_link": venue.facebook_link,
-    "seeking_talent": venue.seeking_talent,
-    "seeking_talent_text": venue.seeking_talent_text,
-    "image_link": venue.image_link
-  }
-
-  past_shows = db.session.query(Show).join(Venue).filter(Venue.id==venue.id, Show.start_time < datetime.now()).all()
-  past_shows_list = []
-  for show in past_shows:
-    artist = Artist.query.get(show.artist_id)
-    dict1 = {
-      "artist_id": artist.id,
-      "artist_name": artist.name,
-      "artist_image_link": artist.image_link,
-      "start_time": show.start_time.strftime("%m/%d/%Y, %H:%M")
-    }
-    past_shows_list.append(dict1)
-
-  upcoming_shows = db.session.query(Show).join(Venue).filter(Venue.id==venue.id, Show.start_time > datetime.now()).all()
-  upcoming_shows_list = []
-  for show in upcoming_shows:
-    artist = Artist.query.get(show.artist_id)
-    dict1 = {
-      "artist_id": artist.id,
-      "artist_name": artist.name,
-      "artist_image_link": artist.image_link,
-      "start_time": show.start_time.strftime("%m/%d/%Y, %H:%M")
-    }
-    upcoming_shows_list.append(dict1)
-  
-  data["past_shows"] = past_shows_list
-  data["upcoming_shows"] = upcoming_shows_list
-  data["past_shows_count"] = len(past_shows_list)
-  data["upcoming_shows_count"] = len(upcoming_shows_list)
-  return render_template('pages/show_venue.html', venue=data)
+  # pages carrying a flashed message are rendered fresh and never cached
+  cacheable = not session.get('_flashes')
+  if cacheable:
+    # the version and the page are read in the same request, so from the same
+    # database, and the page is at least as new as its key
+    key = venue_key(venue_id, page_version(Venue, venue_id))
+    page = page_cache.get(key)
+    if page is not None:
+      return page
+
+  data, expires = venue_details(venue_id)
+  page = render_template('pages/show_venue.html', venue=data)
+  if cacheable:
+    page_cache.set(key, page, expires)
+  return page
 
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
@@ -250,7 +757,10 @@ def edit_artist_submission(artist_id):
       artist.seeking_venue = False
     else:
       artist.seeking_venue = True
+    # venue pages list the artist's name and image too
+    touch(**pages_of_artists([artist_id]))
     db.session.commit()
+    name_index.add('artist', artist_id, request.form['name'])
   except Exception as e:
     print(e)
     error = True
@@ -301,6 +811,7 @@ def create_venue_submission():
         venue.seeking_talent = True
       db.session.add(venue)
       db.session.commit()
+      name_index.add('venue', venue.id, venue.name)
       flash('Venue ' + request.form['name'] + ' was successfully listed!')
     except Exception as e:
       print(e)
@@ -327,13 +838,9 @@ def delete_venue(venue_id):
   #PS
   print("Venue delete function: ", venue_id)
   error = False
-  name = ''
+  names = []
   try:
-    venue = Venue.query.get(venue_id)
-    db.session.query(Show).filter(Show.venue_id==venue_id).delete()
-    name = venue.name
-    db.session.delete(venue)
-    db.session.commit()
+    names, _ = delete_by_id(Venue, [int(venue_id)])
   except Exception as e:
     print(e)
     error = True
@@ -341,24 +848,44 @@ def delete_venue(venue_id):
   finally:
     db.session.close()
   if error:
-    flash('An error occurred. Venue ' + name + ' could not be deleted.')
+    flash('An error occurred. Venue ' + venue_id + ' could not be deleted.')
+  elif not names:
+    flash('Venue ' + venue_id + ' was not found.')
   else:
-    flash('Venue ' + name+ ' deleted successfully')
+    flash('Venue ' + names[0] + ' deleted successfully')
   return render_template('pages/home.html')
 
   # BONUS CHALLENGE: Implement a button to delete a Venue on a Venue Page, have it so that
   # clicking that button delete it from the db then redirect the user to the homepage
 
+@app.route('/venues/delete', methods=['POST'])
+def delete_venues():
+  # removes every venue in venue_ids (and their shows) in one transaction
+  error = False
+  names, missing = [], []
+  try:
+    names, missing = delete_by_id(Venue, request.form.getlist('venue_ids', type=int))
+  except Exception as e:
+    print(e)
+    error = True
+    db.session.rollback()
+  finally:
+    db.session.close()
+  if error:
+    flash('An error occurred. Venues could not be deleted.')
+  else:
+    flash(str(len(names)) + ' venues deleted successfully')
+    if missing:
+      flash('Venues not found: ' + ', '.join(map(str, missing)))
+  return redirect(url_for('index'))
+
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
 def artists():
   # TODO: replace with real data returned from querying the database
-  artists = Artist.query.all()
-  data = []
-  for artist in artists:
-    data.append({"id":artist.id, "name" : artist.name})
-  return render_template('pages/artists.html', artists=data)
+  data, next_cursor = artist_list()
+  return render_template('pages/artists.html', artists=data, next_cursor=next_cursor)
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
@@ -368,19 +895,19 @@ def search_artists():
 
   #PS
   search = request.form.get('search_term', '')
-  artists = Artist.query.filter(Artist.name.ilike("%" + search + "%")).all()
+  artists, next_offset, total = search_by_name(Artist, search, max(0, request.form.get('offset', 0, type=int)))
   data = []
   for artist in artists:
-    upcoming_shows = db.session.query(Show).join(Artist).filter(Artist.id==artist.id, Show.start_time > datetime.now()).count()
-    print(upcoming_shows)
     data.append({
       "id" : artist.id,
       "name" : artist.name,
-      "num_upcoming_shows" : upcoming_shows
+      "num_upcoming_shows" : artist.num_upcoming_shows,
+      "updated_at" : artist.updated_at
     })
   response={
-    "count": len(artists),
-    "data": data
+    "count": total if total is not None else f'more than {SEARCH_CANDIDATES}',
+    "data": data,
+    "next_offset": next_offset
   }
   return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
 
@@ -389,62 +916,48 @@ def show_artist(artist_id):
   # shows the venue page with the given venue_id
   # TODO: replace with real venue data from the venues table, using venue_id
   #PS
-  artist = Artist.query.get(artist_id)
-  data={
-    "id": artist.id,
-    "name": artist.name,
-    "genres": artist.genres,
-    "city": artist.city,
-    "state": artist.state,
-    "phone": artist.phone,
-    "website_link": artist.website_link,
-    "facebook_link": artist.facebook_link,
-    "seeking_venue": artist.seeking_venue,
-    "seeking_venue_text": artist.seeking_venue_text,
-    "image_link": artist.image_link
-  }
-  past_shows = db.session.query(Show).join(Artist).filter(Artist.id==artist.id, Show.start_time < datetime.now()).all()
-  past_shows_list = []
-  for show in past_shows:
-    venue = Venue.query.get(show.venue_id)
-    dict1 = {
-      "venue_id": venue.id,
-      "venue_name": venue.name,
-      "venue_image_link": venue.image_link,
-      "start_time": show.start_time.strftime("%m/%d/%Y, %H:%M")
-    }
-    past_shows_list.append(dict1)
-
-  upcoming_shows = db.session.query(Show).join(Artist).filter(Artist.id==artist.id, Show.start_time > datetime.now()).all()
-  upcoming_shows_list = []
-  for show in upcoming_shows:
-    venue = Venue.query.get(show.venue_id)
-    dict1 = {
-      "venue_id": venue.id,
-      "venue_name": venue.name,
-      "venue_image_link": venue.image_link,
-      "start_time": show.start_time.strftime("%m/%d/%Y, %H:%M")
-    }
-    upcoming_shows_list.append(dict1)
-  
-  data["past_shows"] = past_shows_list
-  data["upcoming_shows"] = upcoming_shows_list
-  data["past_shows_count"] = len(past_shows_list)
-  data["upcoming_shows_count"] = len(upcoming_shows_list)
-  return render_template('pages/show_artist.html', artist=data)
+  # pages carrying a flashed message are rendered fresh and never cached
+  cacheable = not session.get('_flashes')
+  if cacheable:
+    key = artist_key(artist_id, page_version(Artist, artist_id))
+    page = page_cache.get(key)
+    if page is not None:
+      return page
+
+  data, expires = artist_details(artist_id)
+  page = render_template('pages/show_artist.html', artist=data)
+  if cacheable:
+    page_cache.set(key, page, expires)
+  return page
 
 #PS Artist Delete
 
 @app.route('/artists/<artist_id>/delete', methods=['POST'])
 def delete_artist(artist_id):
   error = False
-  name = ''
+  names = []
   try:
-    artist = Artist.query.get(artist_id)
-    db.session.query(Show).filter(Show.artist_id==artist_id).delete()
-    name = artist.name
-    db.session.delete(artist)
-    db.session.commit()
+    names, _ = delete_by_id(Artist, [int(artist_id)])
+  except Exception as e:
+    print(e)
+    error = True
+    db.session.rollback()
+  finally:
+    db.session.close()
+  if error:
+    flash('An error occurred. Artist ' + artist_id + ' could not be deleted.')
+  elif not names:
+    flash('Artist ' + artist_id + ' was not found.')
+  else:
+    flash('Artist ' + names[0] + ' deleted successfully')
+  return redirect(url_for('index'))
+
+@app.route('/artists/delete', methods=['POST'])
+def delete_artists():
+  error = False
+  names, missing = [], []
+  try:
+    names, missing = delete_by_id(Artist, request.form.getlist('artist_ids', type=int))
   except Exception as e:
     print(e)
     error = True
@@ -452,9 +965,11 @@ def delete_artist(artist_id):
   finally:
     db.session.close()
   if error:
-    flash('An error occurred. Artist ' + name + ' could not be deleted.')
+    flash('An error occurred. Artists could not be deleted.')
   else:
-    flash('Artist ' + name+ ' deleted successfully')
+    flash(str(len(names)) + ' artists deleted successfully')
+    if missing:
+      flash('Artists not found: ' + ', '.join(map(str, missing)))
   return redirect(url_for('index'))
 
   # TODO: populate form with values from venue with ID <venue_id>
@@ -478,6 +993,9 @@ def edit_venue_submission(venue_id):
   error = False
   try:
     venue = Venue.query.get(venue_id)
+    if (venue.city, venue.state) != (request.form['city'], request.form['state']):
+      # moved: geocode-venues locates it again on its next run
+      venue.latitude = venue.longitude = venue.geohash = None
     venue.name = request.form['name']
     venue.city = request.form['city']
     venue.state = request.form['state']
@@ -492,7 +1010,9 @@ def edit_venue_submission(venue_id):
       venue.seeking_talent = False
     else:
       venue.seeking_talent = True
+    touch(**pages_of_venues([venue_id]))
     db.session.commit()
+    name_index.add('venue', venue_id, request.form['name'])
   except Exception as e:
     print(e)
     error = True
@@ -540,6 +1060,7 @@ def create_artist_submission():
       artist.seeking_venue = True
     db.session.add(artist)
     db.session.commit()
+    name_index.add('artist', artist.id, artist.name)
   except Exception as e:
     print(e)
     db.session.rollback()
@@ -569,18 +1090,8 @@ def shows():
   #       num_shows should be aggregated based on number of upcoming shows per venue.
 
   #PS
-  shows = db.session.query(Show,Artist,Venue).join(Artist,Venue).all()
-  data=[]
-  for show in shows:
-    data.append({
-      "venue_id": show[2].id,
-      "venue_name": show[2].name,
-      "artist_id": show[1].id,
-      "artist_name": show[1].name,
-      "artist_image_link": show[1].image_link,
-      "start_time": show[0].start_time.strftime("%m/%d/%Y, %H:%M")
-    })
-  return render_template('pages/shows.html', shows=data)
+  data, next_cursor = show_list()
+  return render_template('pages/shows.html', shows=data, next_cursor=next_cursor)
 
 
 @app.route('/shows/create')
@@ -594,6 +1105,12 @@ def create_show_submission():
   # called to create new shows in the db, upon submitting new show listing form
   # TODO: insert form data as a new Show record in the db, instead
 
+  # the duration must be one of the form's choices; anything else goes back
+  # to the form as a field error instead of failing the insert
+  form = ShowForm(request.form)
+  if not form.duration.validate(form):
+    return render_template('forms/new_show.html', form=form), 400
+
   error = False
   date_format = '%Y-%m-%d %H:%M:%S'
   try:
@@ -601,12 +1118,20 @@ def create_show_submission():
     show.artist_id = request.form['artist_id']
     show.venue_id = request.form['venue_id']
     show.start_time = datetime.strptime(request.form['start_time'], date_format)
+    show.end_time = show.start_time + timedelta(minutes=form.duration.data)
     db.session.add(show)
+    touch(venue_ids=[show.venue_id], artist_ids=[show.artist_id])
     db.session.commit()
   except Exception as e:
     error = True
     print(f'Error ==> {e}')
     db.session.rollback()
+    # raised by the show_no_overlap trigger
+    if getattr(getattr(e, 'orig', None), 'pgcode', None) == '23P01':
+      booked = 'venue' if e.orig.diag.constraint_name == 'Show_venue_no_overlap' else 'artist'
+      # the form comes back as entered, with the clash next to the start time
+      form.start_time.errors = [f'The {booked} already has a show at that time. Pick another time.']
+      return render_template('forms/new_show.html', form=form), 409
   finally:
     db.session.close()
   if error: 
@@ -622,8 +1147,96 @@ def create_show_submission():
   # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
   # return render_template('pages/home.html')
 
+#  JSON API
+#  ----------------------------------------------------------------
+
+def api_body(data):
+  # keys are sorted so the same data always serializes, and hashes, the same
+  return json.dumps(data, sort_keys=True, default=lambda value: value.isoformat())
+
+def api_response(data):
+  """Serialize data with a strong ETag and answer 304 when the client has it."""
+  body = api_body(data)
+  response = Response(body, mimetype='application/json')
+  response.set_etag(hashlib.sha256(body.encode()).hexdigest())
+  return response.make_conditional(request)
+
+def api_resource(model, entity_id, details):
+  """Answer a detail resource, validated by resource_version() before any of it is built."""
+  etag, last_modified = resource_version(model, entity_id)
+  if is_resource_modified(request.environ, etag, last_modified=last_modified):
+    response = Response(api_body(details(entity_id)[0]), mimetype='application/json')
+  else:
+    response = Response(status=304)
+  response.set_etag(etag)
+  response.last_modified = last_modified
+  return response
+
+def api_page(data, next_cursor):
+  # listings change whenever any row does, so they carry an ETag only
+  return api_response({
+    "data": data,
+    "next": next_page_url(next_cursor) if next_cursor else None
+  })
+
+@app.route('/api/v1/venues')
+def api_venues():
+  return api_page(*venue_areas())
+
+@app.route('/api/v1/venues/<int:venue_id>')
+def api_venue(venue_id):
+  return api_resource(Venue, venue_id, venue_details)
+
+@app.route('/api/v1/venues/nearby')
+def api_venues_nearby():
+  # ?lat=52.52&lng=13.40&radius=5 (km), nearest first,
+  # or ?bbox=west,south,east,north in degrees, by name
+  limit = page_limit()
+  if 'bbox' in request.args:
+    try:
+      west, south, east, north = map(float, request.args['bbox'].split(','))
+    except ValueError:
+      abort(400)
+    if not (-180 <= west <= 180 and -180 <= east <= 180 and -90 <= south <= north <= 90):
+      abort(400)
+    rows = venues_in_box(west, south, east, north).order_by(Venue.name, Venue.id).limit(limit).all()
+    distances = [None] * len(rows)
+  else:
+    latitude = request.args.get('lat', type=float)
+    longitude = request.args.get('lng', type=float)
+    radius = request.args.get('radius', type=float)
+    if None in (latitude, longitude, radius) or not (-90 <= latitude <= 90 and -180 <= longitude <= 180 and radius > 0):
+      abort(400)
+    distance = distance_from(latitude, longitude)
+    rows = venues_in_box(*geo.box_around(latitude, longitude, radius)).add_columns(distance.label('distance')) \
+      .filter(distance <= radius).order_by(distance, Venue.id).limit(limit).all()
+    distances = [round(row.distance, 3) for row in rows]
+  return api_response({"data": [{
+    "id": row.id,
+    "name": row.name,
+    "city": row.city,
+    "state": row.state,
+    "latitude": row.latitude,
+    "longitude": row.longitude,
+    "distance_km": distance
+  } for row, distance in zip(rows, distances)]})
+
+@app.route('/api/v1/artists')
+def api_artists():
+  return api_page(*artist_list())
+
+@app.route('/api/v1/artists/<int:artist_id>')
+def api_artist(artist_id):
+  return api_resource(Artist, artist_id, artist_details)
+
+@app.route('/api/v1/shows')
+def api_shows():
+  return api_page(*show_list())
+
 @app.errorhandler(404)
 def not_found_error(error):
+    if request.path.startswith('/api/'):
+        return {"error": "not found"}, 404
     return render_template('errors/404.html'), 404
 
 @app.errorhandler(500)
@@ -631,16 +1244,343 @@ def server_error(error):
     return render_template('errors/500.html'), 500
 
 
+def gzip_rotator(source, dest):
+    with open(source, 'rb') as log, gzip.open(dest, 'wb') as archive:
+        shutil.copyfileobj(log, archive)
+    os.remove(source)
+
 if not app.debug:
-    file_handler = FileHandler('error.log')
+    if app.config.get('LOG_ROTATE_WHEN'):
+        file_handler = TimedRotatingFileHandler(app.config['LOG_FILE'], when=app.config['LOG_ROTATE_WHEN'],
+                                                backupCount=app.config['LOG_BACKUP_COUNT'])
+    else:
+        file_handler = RotatingFileHandler(app.config['LOG_FILE'], maxBytes=app.config['LOG_MAX_BYTES'],
+                                           backupCount=app.config['LOG_BACKUP_COUNT'])
+    file_handler.namer = lambda name: name + '.gz'
+    file_handler.rotator = gzip_rotator
     file_handler.setFormatter(
         Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
     )
-    app.logger.setLevel(logging.INFO)
     file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
+    # request threads only put records on the queue; the listener thread does
+    # the disk writes, rotation and compression
+    log_queue = queue.Queue(-1)
+    log_listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    log_listener.start()
+    atexit.register(log_listener.stop)
+    app.logger.setLevel(logging.INFO)
+    app.logger.addHandler(QueueHandler(log_queue))
     app.logger.info('errors')
 
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+# The overlap trigger's two probes (see the show_no_overlap migration), with
+# the booking's end time as :end_time
+BOOKING_PROBES = {
+  'venue booking check': ('SELECT id, end_time FROM "Show" WHERE venue_id = :id AND start_time < :end_time '
+                          'ORDER BY start_time DESC LIMIT 1', 'ix_Show_venue_id_start_time'),
+  'artist booking check': ('SELECT id, end_time FROM "Show" WHERE artist_id = :id AND start_time < :end_time '
+                           'ORDER BY start_time DESC LIMIT 1', 'ix_Show_artist_id_start_time'),
+}
+# below this many shows the planner rightly reads the whole table, and its
+# plans say nothing about the indexes
+CHECK_INDEXES_MIN_SHOWS = 10000
+
+def hot_show_queries(venue_id, artist_id):
+  """Yield (name, statement, index) for the hot Show queries.
+
+  The statements are built by the same functions the views use, so the check
+  explains what the app actually sends; index is the one the plan must use.
+  """
+  now = datetime.now()
+  yield 'venue timeline', venue_timeline(venue_id).statement, 'ix_Show_venue_id_start_time'
+  yield 'artist timeline', artist_timeline(artist_id).statement, 'ix_Show_artist_id_start_time'
+  yield 'shows listing', keyset_page(show_listing(now), SHOW_KEY, None, PAGE_SIZE).statement, 'ix_Show_start_time_id'
+  yield 'shows in a week', keyset_page(show_listing(now, now + timedelta(days=7)), SHOW_KEY, None,
+                                       PAGE_SIZE).statement, 'ix_Show_start_time_id'
+  yield 'shows listing, next page', keyset_page(show_listing(now), SHOW_KEY, [now + timedelta(days=30), 0],
+                                                PAGE_SIZE).statement, 'ix_Show_start_time_id'
+  for name, entity_id in (('venue booking check', venue_id), ('artist booking check', artist_id)):
+    sql, index = BOOKING_PROBES[name]
+    yield name, db.text(sql).bindparams(id=entity_id, end_time=now), index
+
+def preload_templates():
+  """Compile every page, form and error template; returns (count, seconds)."""
+  started = time.perf_counter()
+  names = app.jinja_env.list_templates(filter_func=lambda name: name.endswith('.html'))
+  for name in names:
+    app.jinja_env.get_template(name)
+  return len(names), time.perf_counter() - started
+
+@app.cli.command('preload-templates')
+def preload_templates_command():
+  """Fill the template bytecode cache, e.g. as a deploy step."""
+  count, elapsed = preload_templates()
+  print(f'compiled {count} templates in {elapsed * 1000:.1f} ms')
+
+@app.cli.command('check-indexes')
+def check_indexes():
+  """Fail unless every hot Show query plans on its index.
+
+  Plans come from the planner's own settings, so run this against
+  production-sized data, e.g. after generate-data --load.
+  """
+  shows = db.session.execute(db.text('SELECT reltuples FROM pg_class WHERE oid = \'"Show"\'::regclass')).scalar()
+  if shows < CHECK_INDEXES_MIN_SHOWS:
+    print(f'"Show" holds about {shows:.0f} rows; load at least {CHECK_INDEXES_MIN_SHOWS} '
+          f'(and ANALYZE) before checking its plans')
+    sys.exit(1)
+  # an ordinary venue and artist, not the busiest, whose timelines
+  # are a sizeable share of the table
+  venue_id = db.session.query(db.func.min(Show.venue_id)).scalar()
+  artist_id = db.session.query(db.func.min(Show.artist_id)).scalar()
+  failed = []
+  cursor = db.session.connection().connection.cursor()
+  for name, statement, index in hot_show_queries(venue_id, artist_id):
+    compiled = statement.compile(dialect=db.engine.dialect)
+    cursor.execute('EXPLAIN ' + str(compiled), compiled.params)
+    plan = '\n'.join(row[0] for row in cursor)
+    if f'"{index}"' in plan:
+      print(f'{name}: ok, {index}')
+    else:
+      failed.append(name)
+      print(f'{name}: does not use {index}\n{plan}')
+  db.session.rollback()
+  if failed:
+    sys.exit(1)
+
+@app.cli.command('refresh-upcoming-counts')
+def refresh_upcoming_counts():
+  """Move shows that have started out of the upcoming show counters.
+
+  Inserts, updates and deletes of shows keep the counters exact through
+  triggers; this catches up with the passage of time. Run it from cron
+  every few minutes.
+  """
+  db.session.execute(db.text('SELECT refresh_upcoming_show_counts()'))
+  db.session.commit()
+
+@app.cli.command('import-data')
+@click.argument('kind', type=click.Choice(['venues', 'artists', 'shows']))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=5000, help='Rows sent per COPY.')
+def import_data(kind, path, batch_size):
+  """Bulk load venues, artists or shows from a .csv or .jsonl file."""
+  table = {'venues': 'Venue', 'artists': 'Artist', 'shows': 'Show'}[kind]
+  connection = db.engine.raw_connection()
+  try:
+    loaded, rejected = importer.load(connection, table, path, batch_size)
+  finally:
+    connection.close()
+  print(f'{loaded} {kind} imported, {rejected} rejected for unknown venue or artist')
+
+@app.cli.command('geocode-venues')
+@click.argument('gazetteer', type=click.Path(exists=True, dir_okay=False))
+@click.option('--all', 'everything', is_flag=True, help='Locate venues that already have coordinates too.')
+def geocode_venues(gazetteer, everything):
+  """Set venue coordinates from a city,state,latitude,longitude CSV file."""
+  places = geo.Gazetteer(gazetteer)
+  query = db.session.query(Venue.id, Venue.city, Venue.state)
+  if not everything:
+    query = query.filter(Venue.latitude.is_(None))
+  located = missing = 0
+  updates = []
+  for venue in query.yield_per(5000):
+    point = places.locate(venue.city, venue.state)
+    if point is None:
+      missing += 1
+      continue
+    updates.append({'venue_id': venue.id, 'lat': point[0], 'lng': point[1], 'hash': geo.encode(*point)})
+  for start in range(0, len(updates), 5000):
+    db.session.execute(Venue.__table__.update().where(Venue.id == db.bindparam('venue_id'))
+                       .values(latitude=db.bindparam('lat'), longitude=db.bindparam('lng'),
+                               geohash=db.bindparam('hash')), updates[start:start + 5000])
+    located += len(updates[start:start + 5000])
+  db.session.commit()
+  print(f'{located} venues located, {missing} not in the gazetteer')
+
+@app.cli.command('bench-bookings')
+@click.option('--shows', default=100000, help='Shows already booked at the venue.')
+@click.option('--attempts', default=1000, help='Bookings to try, half of them clashing.')
+def bench_bookings(shows, attempts):
+  """Time the overlap check against a venue with many shows; nothing is kept."""
+  with db.engine.connect() as connection:
+    transaction = connection.begin()
+    try:
+      venue_id = connection.execute(db.text(
+        'INSERT INTO "Venue" (name, city, address) VALUES (\'bench\', \'bench\', \'bench\') RETURNING id')).scalar()
+      artist_ids = [connection.execute(db.text(
+        'INSERT INTO "Artist" (name, city) VALUES (\'bench\', \'bench\') RETURNING id')).scalar() for _ in range(2)]
+      # back to back two hour shows, alternating between the two artists
+      began = time.perf_counter()
+      connection.execute(db.text(
+        'INSERT INTO "Show" (venue_id, artist_id, start_time, end_time) '
+        'SELECT :venue_id, CASE WHEN i % 2 = 0 THEN :first ELSE :second END, '
+        '  timestamp \'2000-01-01\' + i * interval \'2 hours\', timestamp \'2000-01-01\' + (i + 1) * interval \'2 hours\' '
+        'FROM generate_series(0, :shows - 1) i'), {'venue_id': venue_id, 'first': artist_ids[0],
+                                                   'second': artist_ids[1], 'shows': shows})
+      elapsed = time.perf_counter() - began
+      print(f'booked {shows} shows in {elapsed:.1f} s, {shows / elapsed:.0f} checked inserts/s')
+
+      insert = db.text('INSERT INTO "Show" (venue_id, artist_id, start_time, end_time) '
+                       'VALUES (:venue_id, :artist_id, :start_time, :end_time)')
+      timings = {True: [], False: []}
+      for attempt in range(attempts):
+        clash = attempt % 2 == 0
+        # clashing bookings land anywhere in the history, free ones after it
+        hours = random.randrange(2 * shows) if clash else 2 * shows + 2 * attempt
+        start = datetime(2000, 1, 1) + timedelta(hours=hours, minutes=30)
+        savepoint = connection.begin_nested()
+        began = time.perf_counter()
+        try:
+          connection.execute(insert, {'venue_id': venue_id, 'artist_id': artist_ids[0],
+                                      'start_time': start, 'end_time': start + timedelta(hours=1)})
+        except exc.IntegrityError:
+          pass
+        timings[clash].append(time.perf_counter() - began)
+        savepoint.rollback()
+      for clash, label in ((True, 'clashing'), (False, 'free')):
+        samples = timings[clash]
+        print(f'{label} booking: {sum(samples) / len(samples) * 1000:.3f} ms on average over {len(samples)} tries')
+    finally:
+      transaction.rollback()
+
+@app.cli.command('generate-data')
+@click.argument('directory', type=click.Path(file_okay=False))
+@click.option('--venues', default=1000, help='Number of venues.')
+@click.option('--artists', default=2000, help='Number of artists.')
+@click.option('--shows', default=50000, help='Number of shows; a few may be dropped for lack of free slots.')
+@click.option('--seed', default=42, help='Random seed; the same seed writes the same files.')
+@click.option('--load', is_flag=True, help='Import the files right away.')
+def generate_data(directory, venues, artists, shows, seed, load):
+  """Write seeded venues, artists and shows CSV files for import-data."""
+  # ids continue after the rows already in the database
+  first_ids = [(db.session.query(db.func.max(model.id)).scalar() or 0) + 1 for model in (Venue, Artist, Show)]
+  genres = [genre for genre, _ in VenueForm.genres.kwargs['choices']]
+  written = bench.generate(directory, venues, artists, shows, genres, first_ids, seed)
+  print(f'{venues} venues, {artists} artists and {written} shows written to {directory}')
+  if load:
+    connection = db.engine.raw_connection()
+    try:
+      for kind, table in (('venues', 'Venue'), ('artists', 'Artist'), ('shows', 'Show')):
+        importer.load(connection, table, os.path.join(directory, kind + '.csv'))
+    finally:
+      connection.close()
+
+@app.cli.command('bench-routes')
+@click.option('--requests', default=100, help='Requests per route.')
+@click.option('--baseline', default='bench_baseline.json', help='Stored results to compare against.')
+@click.option('--save', is_flag=True, help='Store this run as the new baseline.')
+@click.option('--tolerance', default=0.25, help='p95 growth allowed before a route counts as regressed.')
+@click.option('--seed', default=42, help='Random seed for the venues and artists visited.')
+def bench_routes(requests, baseline, save, tolerance, seed):
+  """Time every page and API route against the current database."""
+  # the same seed visits the same pages, so runs compare like with like
+  random.seed(seed)
+  db.session.execute(db.text('SELECT setseed(:seed)'), {'seed': random.random()})
+  sample = lambda model: [row.id for row in db.session.query(model.id).order_by(db.func.random()).limit(200)] or [0]
+  busiest = lambda column: db.session.query(column).group_by(column).order_by(db.func.count().desc()).limit(1).scalar() or 0
+  venue_ids, artist_ids = sample(Venue), sample(Artist)
+  busiest_venue, busiest_artist = busiest(Show.venue_id), busiest(Show.artist_id)
+  today = datetime.now().date()
+  week = f'/shows?from={today}&to={today + timedelta(days=7)}'
+  routes = {
+    'home': ('GET', lambda: '/', None),
+    'venues': ('GET', lambda: '/venues', None),
+    'artists': ('GET', lambda: '/artists', None),
+    'shows': ('GET', lambda: '/shows', None),
+    'shows this week': ('GET', lambda: week, None),
+    'search venues': ('POST', lambda: '/venues/search', {'search_term': 'Hall'}),
+    'search artists': ('POST', lambda: '/artists/search', {'search_term': 'Band'}),
+    'venue page': ('GET', lambda: f'/venues/{random.choice(venue_ids)}', None),
+    'venue page, busiest': ('GET', lambda: f'/venues/{busiest_venue}', None),
+    'artist page': ('GET', lambda: f'/artists/{random.choice(artist_ids)}', None),
+    'artist page, busiest': ('GET', lambda: f'/artists/{busiest_artist}', None),
+    'api venues': ('GET', lambda: '/api/v1/venues', None),
+    'api venue': ('GET', lambda: f'/api/v1/venues/{random.choice(venue_ids)}', None),
+    'api shows': ('GET', lambda: '/api/v1/shows', None),
+    'api venues nearby': ('GET', lambda: '/api/v1/venues/nearby?lat=52.52&lng=13.405&radius=25', None),
+    'api artists': ('GET', lambda: '/api/v1/artists', None),
+    'api artist': ('GET', lambda: f'/api/v1/artists/{random.choice(artist_ids)}', None),
+    'autocomplete': ('GET', lambda: '/autocomplete?q=gold', None),
+    'new venue form': ('GET', lambda: '/venues/create', None),
+    'new artist form': ('GET', lambda: '/artists/create', None),
+    'new show form': ('GET', lambda: '/shows/create', None),
+    'edit venue form': ('GET', lambda: f'/venues/{random.choice(venue_ids)}/edit', None),
+    'edit artist form': ('GET', lambda: f'/artists/{random.choice(artist_ids)}/edit', None),
+  }
+  # every booking takes the next free slot, two years out where the seeded
+  # shows never reach, so the overlap trigger checks it and lets it through
+  slots = itertools.count()
+  first_slot = datetime(today.year + 2, 1, 1)
+  def booking():
+    start = first_slot + next(slots) * bench.SLOT
+    return {'artist_id': random.choice(artist_ids), 'venue_id': random.choice(venue_ids),
+            'start_time': start.strftime('%Y-%m-%d %H:%M:%S'), 'duration': 120}
+  writes = {
+    'create show': ('POST', lambda: '/shows/create', booking),
+  }
+  # detail pages are timed as rendered, not as served from the page cache
+  cache_backend, page_cache.backend = page_cache.backend, MemoryBackend(0)
+  try:
+    client = app.test_client()
+    results = bench.run(client, routes, requests)
+    # writes go through one connection whose transaction is rolled back, so
+    # the database is left as it was; the session is bound to it directly,
+    # since Flask-SQLAlchemy otherwise binds every table to the engine
+    with db.engine.connect() as connection:
+      transaction = connection.begin()
+      db.session.remove()
+      db.session.configure(bind=connection, binds={})
+      try:
+        results.update(bench.run(client, writes, requests))
+      finally:
+        db.session.remove()
+        db.session.configure(bind=None, binds=db.get_binds())
+        transaction.rollback()
+  finally:
+    page_cache.backend = cache_backend
+  regressions = []
+  for route, line, regressed in bench.compare(results, bench.load_baseline(baseline), tolerance):
+    print(line)
+    if regressed:
+      regressions.append(route)
+  if save:
+    bench.save_baseline(baseline, results)
+    print(f'baseline saved to {baseline}')
+  elif regressions:
+    print(f'regressed: {", ".join(regressions)}')
+    sys.exit(1)
+
+@app.cli.command('bench-datetime')
+@click.option('--rows', default=10000, help='Number of show rows to format.')
+def bench_datetime(rows):
+  """Compare the datetime filter with the old parse-every-row path."""
+  start = datetime(2020, 1, 1, 20, 0)
+  values = [start + timedelta(hours=i) for i in range(rows)]
+
+  def old_filter(value, format='full'):
+    date = dateutil.parser.parse(value)
+    return babel.dates.format_datetime(date, "EEEE MMMM, d, y 'at' h:mma")
+
+  timings = [
+    ('string, parse + babel', old_filter, [value.strftime("%m/%d/%Y, %H:%M") for value in values]),
+    ('datetime, cached pattern', format_datetime, values),
+  ]
+  for name, filter, inputs in timings:
+    began = time.perf_counter()
+    for value in inputs:
+      filter(value, 'full')
+    elapsed = time.perf_counter() - began
+    print(f'{name}: {elapsed * 1000:.1f} ms per {rows} rows, {elapsed / rows * 1e6:.2f} us per row')
+
+# workers pay for template loading at start-up rather than on first requests
+if app.config['PRELOAD_TEMPLATES']:
+    count, elapsed = preload_templates()
+    app.logger.info('preloaded %d templates in %.1f ms', count, elapsed * 1000)
+
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
@@ -0,0 +1,116 @@
+from bisect import bisect_left, insort
+import logging
+import threading
+import time
+
+# In-memory prefix index of venue and artist names for /autocomplete.
+#
+# Every word of a name starts one key, so "hop" and "musical h" both find
+# "The Musical Hop". Keys live in one sorted list; a prefix lookup is a bisect
+# to the first key at or after the prefix and a walk while keys still start
+# with it, so no query reaches Postgres. The create, edit and delete handlers
+# update the index of the worker that served them; every other worker, and
+# rows added by import-data, catch up when the index is rebuilt after
+# max_age seconds.
+#
+# A rebuild runs in a background thread, one at a time per index, while
+# searches keep using the old index. Changes made while it reads are
+# recorded and replayed onto the new index before it is swapped in, so they
+# are not lost with the old one. A failed rebuild is logged to the logger the
+# index was given, and the old index stays in use until the next try.
+
+
+def keys_of(name):
+    words = name.casefold().split()
+    return [' '.join(words[start:]) for start in range(len(words))]
+
+
+class PrefixIndex:
+
+    def __init__(self, max_age=300, logger=None):
+        self.max_age = max_age
+        self.logger = logger or logging.getLogger(__name__)
+        self.entries = []
+        self.keys = {}
+        self.built = None
+        self.lock = threading.Lock()
+        # set once the first build is in
+        self.ready = threading.Event()
+        # changes since the running rebuild started reading; None when none runs
+        self.pending = None
+
+    def refresh(self, load):
+        """Rebuild from load(), rows of (kind, id, name), in the background if the index is stale."""
+        with self.lock:
+            if self.pending is not None or not self.stale():
+                return
+            self.pending = []
+        threading.Thread(target=self._rebuild, args=(load,), daemon=True).start()
+
+    def _rebuild(self, load):
+        try:
+            self.build(load())
+        except Exception:
+            self.logger.exception('autocomplete index rebuild failed')
+        finally:
+            with self.lock:
+                self.pending = None
+
+    def build(self, rows):
+        """Replace the index with rows of (kind, id, name), keeping changes made meanwhile."""
+        entries = []
+        keys = {}
+        for kind, entity_id, name in rows:
+            keys[kind, entity_id] = [(key, kind, entity_id, name) for key in keys_of(name)]
+            entries.extend(keys[kind, entity_id])
+        entries.sort()
+        with self.lock:
+            self.entries, self.keys = entries, keys
+            for change, args in self.pending or ():
+                change(*args)
+            self.built = time.monotonic()
+        self.ready.set()
+
+    def stale(self):
+        return self.built is None or time.monotonic() - self.built > self.max_age
+
+    def add(self, kind, entity_id, name):
+        with self.lock:
+            self._add(kind, entity_id, name)
+            if self.pending is not None:
+                self.pending.append((self._add, (kind, entity_id, name)))
+
+    def remove(self, kind, entity_id):
+        with self.lock:
+            self._remove(kind, entity_id)
+            if self.pending is not None:
+                self.pending.append((self._remove, (kind, entity_id)))
+
+    def _add(self, kind, entity_id, name):
+        self._remove(kind, entity_id)
+        self.keys[kind, entity_id] = [(key, kind, entity_id, name) for key in keys_of(name)]
+        for entry in self.keys[kind, entity_id]:
+            insort(self.entries, entry)
+
+    def _remove(self, kind, entity_id):
+        for entry in self.keys.pop((kind, entity_id), ()):
+            index = bisect_left(self.entries, entry)
+            if index < len(self.entries) and self.entries[index] == entry:
+                del self.entries[index]
+
+    def search(self, prefix, limit=10):
+        """Return up to limit (kind, id, name) matches, each entity once, in key order."""
+        prefix = ' '.join(prefix.casefold().split())
+        matches = []
+        seen = set()
+        with self.lock:
+            index = bisect_left(self.entries, (prefix,))
+            while index < len(self.entries) and len(matches) < limit:
+                key, kind, entity_id, name = self.entries[index]
+                if not key.startswith(prefix):
+                    break
+                if (kind, entity_id) not in seen:
+                    seen.add((kind, entity_id))
+                    matches.append((kind, entity_id, name))
+                index += 1
+        return matches
@@ -0,0 +1,206 @@
+import csv
+from datetime import datetime, timedelta
+import json
+import os
+import random
+import time
+import tracemalloc
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Synthetic data and a benchmark of the Fyyur routes.
+#
+# generate() writes venues.csv, artists.csv and shows.csv for import-data.
+# Popularity is Zipf-like, the way real listings are: a few big cities hold
+# most venues, and a few venues and artists play most shows. The same seed
+# always gives the same files. Shows are spread over two-hour slots, and no
+# venue or artist is booked into the same slot twice, so the show_no_overlap
+# trigger accepts every row.
+#
+# run() drives routes through the Flask test client and reports latency
+# percentiles, SQL statements per request and peak Python memory per route.
+# compare() diffs one run against a stored baseline.
+
+CITIES = (('Berlin', 'Berlin'), ('Hamburg', 'Hamburg'), ('München', 'Bayern'), ('Köln', 'Nordrhein-Westfalen'),
+          ('Frankfurt am Main', 'Hessen'), ('Stuttgart', 'Baden-Württemberg'), ('Düsseldorf', 'Nordrhein-Westfalen'),
+          ('Leipzig', 'Sachsen'), ('Dortmund', 'Nordrhein-Westfalen'), ('Essen', 'Nordrhein-Westfalen'),
+          ('Bremen', 'Bremen'), ('Dresden', 'Sachsen'), ('Hannover', 'Niedersachsen'), ('Nürnberg', 'Bayern'),
+          ('Duisburg', 'Nordrhein-Westfalen'), ('Bochum', 'Nordrhein-Westfalen'), ('Wuppertal', 'Nordrhein-Westfalen'),
+          ('Bielefeld', 'Nordrhein-Westfalen'), ('Bonn', 'Nordrhein-Westfalen'), ('Münster', 'Nordrhein-Westfalen'),
+          ('Mannheim', 'Baden-Württemberg'), ('Karlsruhe', 'Baden-Württemberg'), ('Augsburg', 'Bayern'),
+          ('Wiesbaden', 'Hessen'), ('Mainz', 'Rheinland-Pfalz'), ('Kiel', 'Schleswig-Holstein'),
+          ('Freiburg im Breisgau', 'Baden-Württemberg'), ('Rostock', 'Mecklenburg-Vorpommern'),
+          ('Erfurt', 'Thüringen'), ('Potsdam', 'Brandenburg'))
+VENUE_WORDS = (('The', 'Old', 'Blue', 'Red', 'Golden', 'Little', 'Grand', 'Velvet', 'Iron', 'Silver'),
+               ('Musical', 'Jazz', 'Rock', 'Harbour', 'Park', 'Garden', 'Station', 'Factory', 'River', 'Cellar'),
+               ('Hop', 'Hall', 'Club', 'Lounge', 'Stage', 'Bar', 'Arena', 'House', 'Room', 'Theatre'))
+ARTIST_WORDS = (('Guns N', 'The Wild', 'Matt', 'Neon', 'Electric', 'Silent', 'Midnight', 'Broken', 'Crystal', 'Lazy'),
+                ('Petals', 'Sax', 'Quevado', 'Wolves', 'Echoes', 'Rivers', 'Giants', 'Pilots', 'Tigers', 'Strings'),
+                ('', 'Band', 'Trio', 'Quartet', 'Collective', 'Orchestra', 'Project', 'Crew', 'Ensemble', 'Duo'))
+SLOT = timedelta(hours=2)
+# shows fall between two years ago and one year ahead
+PAST_SLOTS = 2 * 365 * 12
+FUTURE_SLOTS = 365 * 12
+# p95 changes smaller than this are timer noise, whatever the percentage
+NOISE_MS = 1.0
+
+
+def zipf_weights(count, exponent=1.1):
+    return [1 / rank ** exponent for rank in range(1, count + 1)]
+
+
+def name(words, index):
+    return ' '.join(word for word in (random.choice(part) for part in words) if word) + ' ' + str(index)
+
+
+def generate(directory, venues, artists, shows, genres, first_ids=(1, 1, 1), seed=42, now=None):
+    """Write the seeded CSV files into directory; returns the number of shows written.
+
+    first_ids are the first (venue, artist, show) ids to use, so the files
+    can be loaded into a database that already has rows.
+    """
+    random.seed(seed)
+    now = (now or datetime.now()).replace(minute=0, second=0, microsecond=0)
+    os.makedirs(directory, exist_ok=True)
+    first_venue, first_artist, first_show = first_ids
+    city_weights = zipf_weights(len(CITIES))
+
+    with open(os.path.join(directory, 'venues.csv'), 'w', newline='', encoding='utf-8') as out:
+        writer = csv.writer(out)
+        writer.writerow(('id', 'name', 'city', 'state', 'address', 'phone', 'genres', 'seeking_talent'))
+        for index in range(venues):
+            city, state = random.choices(CITIES, city_weights)[0]
+            writer.writerow((first_venue + index, name(VENUE_WORDS, index), city, state,
+                             '{} Hauptstraße'.format(random.randint(1, 200)), '030-{:07d}'.format(index),
+                             ','.join(random.sample(genres, random.randint(1, 3))), random.random() < 0.3))
+
+    with open(os.path.join(directory, 'artists.csv'), 'w', newline='', encoding='utf-8') as out:
+        writer = csv.writer(out)
+        writer.writerow(('id', 'name', 'city', 'state', 'phone', 'genres', 'seeking_venue'))
+        for index in range(artists):
+            city, state = random.choices(CITIES, city_weights)[0]
+            writer.writerow((first_artist + index, name(ARTIST_WORDS, index), city, state,
+                             '0170-{:07d}'.format(index), ','.join(random.sample(genres, random.randint(1, 2))),
+                             random.random() < 0.3))
+
+    # venues and artists are drawn in a shuffled order, so the busiest ones
+    # are not simply the lowest ids
+    venue_ids = random.sample(range(first_venue, first_venue + venues), venues)
+    artist_ids = random.sample(range(first_artist, first_artist + artists), artists)
+    venue_weights, artist_weights = zipf_weights(venues), zipf_weights(artists)
+    booked = set()
+    written = 0
+    with open(os.path.join(directory, 'shows.csv'), 'w', newline='', encoding='utf-8') as out:
+        writer = csv.writer(out)
+        writer.writerow(('id', 'artist_id', 'venue_id', 'start_time', 'end_time'))
+        for venue_id, artist_id in zip(random.choices(venue_ids, venue_weights, k=shows),
+                                       random.choices(artist_ids, artist_weights, k=shows)):
+            # a busy venue or artist can run out of free slots; give up on
+            # the show after a few tries rather than skew towards empty ones
+            for _ in range(10):
+                slot = random.randrange(-PAST_SLOTS, FUTURE_SLOTS)
+                if ('venue', venue_id, slot) not in booked and ('artist', artist_id, slot) not in booked:
+                    break
+            else:
+                continue
+            booked.add(('venue', venue_id, slot))
+            booked.add(('artist', artist_id, slot))
+            start = now + slot * SLOT
+            writer.writerow((first_show + written, artist_id, venue_id, start, start + SLOT))
+            written += 1
+    return written
+
+
+def percentile(samples, fraction):
+    # nearest rank on a sorted list
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+class QueryCounter:
+
+    def __init__(self):
+        self.count = 0
+
+    def __enter__(self):
+        event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(Engine, 'before_cursor_execute', self.before_cursor_execute)
+
+    def before_cursor_execute(self, *args):
+        self.count += 1
+
+
+def form(data):
+    return data() if callable(data) else data
+
+
+def run(client, routes, requests):
+    """Request every route requests times and return {route name: stats}.
+
+    routes maps a name to (method, url factory, form data); the factory is
+    called for every request, so a route can visit different ids. The form
+    data may be a factory as well, for posts that must differ every time.
+    """
+    results = {}
+    for route, (method, url_of, data) in routes.items():
+        # one untimed request first, so connections and templates are warm
+        client.open(url_of(), method=method, data=form(data))
+        timings = []
+        with QueryCounter() as queries:
+            for _ in range(requests):
+                url = url_of()
+                began = time.perf_counter()
+                response = client.open(url, method=method, data=form(data))
+                timings.append(time.perf_counter() - began)
+                if response.status_code >= 500:
+                    raise RuntimeError('{} {} answered {}'.format(method, url, response.status_code))
+        # memory is traced in a separate pass, since tracing slows every request
+        tracemalloc.start()
+        client.open(url_of(), method=method, data=form(data))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        timings.sort()
+        results[route] = {
+            'p50_ms': round(percentile(timings, 0.5) * 1000, 3),
+            'p95_ms': round(percentile(timings, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(timings, 0.99) * 1000, 3),
+            'queries': round(queries.count / requests, 2),
+            'peak_kb': round(peak / 1024, 1),
+        }
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Yield (route, report line, regressed) for every route in results.
+
+    A route has regressed if its p95 grew by more than tolerance (a fraction)
+    and NOISE_MS, or it issues more queries than in the baseline.
+    """
+    for route, stats in results.items():
+        line = '{:<24} p50 {p50_ms:8.2f} ms  p95 {p95_ms:8.2f} ms  p99 {p99_ms:8.2f} ms  ' \
+               '{queries:6.1f} queries  {peak_kb:8.1f} KiB'.format(route, **stats)
+        before = baseline.get(route)
+        if before is None:
+            yield route, line, False
+            continue
+        change = stats['p95_ms'] / before['p95_ms'] - 1 if before['p95_ms'] else 0
+        slower = change > tolerance and stats['p95_ms'] - before['p95_ms'] > NOISE_MS
+        regressed = slower or stats['queries'] > before['queries']
+        line += '  p95 {:+.0%}, queries {:+g}{}'.format(change, stats['queries'] - before['queries'],
+                                                         '  REGRESSED' if regressed else '')
+        yield route, line, regressed
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as source:
+        return json.load(source)
+
+
+def save_baseline(path, results):
+    with open(path, 'w') as out:
+        json.dump(results, out, indent=2, sort_keys=True)
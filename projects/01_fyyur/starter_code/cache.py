@@ -0,0 +1,141 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import threading
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+# Rendered page cache for the venue and artist detail pages.
+#
+# A page's key holds the venue's or artist's updated_at, and anything that
+# changes what a page shows moves updated_at: edits, touch() in app.py and
+# the show importer. A request looks the version up first, so every worker
+# and every backend misses as soon as the row changes, and an old page can
+# only ever be found under its old key. Nothing is deleted; old versions age
+# out of the LRU or expire.
+#
+# Every entry carries an expiry time: a detail page splits shows into past
+# and upcoming, so it goes stale the moment its next upcoming show starts,
+# and no page lives longer than the cache's ttl in any case.
+#
+# Listings cache smaller pieces: {% cache 'venue', venue.id, venue.updated_at %}
+# keeps the rendered markup of one card in an in-process LRU. The entity's
+# version is part of the key, so an edited venue or artist simply misses and
+# its old card ages out; nothing has to be invalidated.
+
+
+class MemoryBackend:
+    """In-process LRU store, bounded to max_entries pages."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            page, expires = entry
+            if expires is not None and expires <= datetime.now():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return page
+
+    def set(self, key, page, expires=None):
+        with self.lock:
+            self.entries[key] = (page, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+
+class RedisBackend:
+    """Store shared by every worker; size is bounded by redis' maxmemory policy."""
+
+    def __init__(self, url, prefix='fyyur:page:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        page = self.client.get(self.prefix + key)
+        return None if page is None else page.decode()
+
+    def set(self, key, page, expires=None):
+        ttl = None
+        if expires is not None:
+            ttl = int((expires - datetime.now()).total_seconds())
+            if ttl <= 0:
+                return
+        self.client.set(self.prefix + key, page.encode(), ex=ttl)
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+
+class PageCache:
+
+    def __init__(self, backend, ttl=300):
+        self.backend = backend
+        self.ttl = timedelta(seconds=ttl)
+
+    @classmethod
+    def from_config(cls, config):
+        if config.get('PAGE_CACHE_BACKEND') == 'redis':
+            backend = RedisBackend(config['PAGE_CACHE_REDIS_URL'])
+        else:
+            backend = MemoryBackend(config.get('PAGE_CACHE_SIZE', 1024))
+        return cls(backend, config.get('PAGE_CACHE_TTL', 300))
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, page, expires=None):
+        deadline = datetime.now() + self.ttl
+        self.backend.set(key, page, deadline if expires is None else min(expires, deadline))
+
+
+def venue_key(venue_id, version):
+    return 'venue:{}:{}'.format(int(venue_id), version.isoformat())
+
+
+def artist_key(artist_id, version):
+    return 'artist:{}:{}'.format(int(artist_id), version.isoformat())
+
+
+class FragmentCacheExtension(Extension):
+    """The {% cache key, ... %}...{% endcache %} tag; needs environment.fragment_cache."""
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=MemoryBackend(0))
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        # the same entity gets a separate card in every template that caches one
+        parts = [nodes.Const('{}:{}'.format(parser.name, lineno)), parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', [nodes.List(parts)]), [], [], body).set_lineno(lineno)
+
+    def _render(self, parts, caller):
+        key = ':'.join(map(str, parts))
+        # the backend keeps the Markup object itself, so autoescaping
+        # does not escape a cached fragment a second time
+        fragment = self.environment.fragment_cache.get(key)
+        if fragment is None:
+            fragment = caller()
+            self.environment.fragment_cache.set(key, fragment)
+        return fragment
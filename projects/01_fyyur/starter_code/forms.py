@@ -16,6 +16,12 @@ class ShowForm(FlaskForm):
         validators=[DataRequired()],
         default= datetime.today()
     )
+    duration = SelectField(
+        'duration',
+        choices=[(60, '1 hour'), (90, '1.5 hours'), (120, '2 hours'), (180, '3 hours'), (240, '4 hours')],
+        coerce=int,
+        default=120
+    )
 
 class VenueForm(FlaskForm):
     name = StringField(
@@ -0,0 +1,119 @@
+import csv
+from math import asin, ceil, cos, degrees, floor, radians, sin, sqrt
+
+# Venue coordinates and the geohash index behind the nearby-venue search.
+#
+# Without PostGIS, every venue with coordinates carries a geohash. Nearby
+# points share a geohash prefix, so any box on the map is covered by a few
+# prefixes, and each prefix is one range scan on a plain B-tree over the
+# geohash column. The cells over-cover the box; callers filter the
+# candidates on the exact box or radius.
+#
+# Coordinates come from a local gazetteer, a CSV file with city, state,
+# latitude and longitude columns, so geocoding never calls out to a service.
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+PRECISION = 12
+# most prefixes one search may scan; coarser cells are used above this
+MAX_CELLS = 32
+EARTH_RADIUS_KM = 6371.0
+
+
+def encode(latitude, longitude, precision=PRECISION):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash = []
+    bits = bit = 0
+    even = True
+    while len(geohash) < precision:
+        value, interval = (longitude, lng_range) if even else (latitude, lat_range)
+        middle = (interval[0] + interval[1]) / 2
+        if value >= middle:
+            bits = bits * 2 + 1
+            interval[0] = middle
+        else:
+            bits = bits * 2
+            interval[1] = middle
+        even = not even
+        bit += 1
+        if bit == 5:
+            geohash.append(BASE32[bits])
+            bits = bit = 0
+    return ''.join(geohash)
+
+
+def cell_size(precision):
+    """Return the (height, width) in degrees of a geohash cell."""
+    lng_bits = ceil(5 * precision / 2)
+    lat_bits = 5 * precision - lng_bits
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def cover(west, south, east, north):
+    """Return the geohash prefixes of the cells overlapping a box, at most MAX_CELLS of them.
+
+    A box with west > east crosses the antimeridian; its two halves share
+    the cell budget.
+    """
+    spans = [(west, 180.0), (-180.0, east)] if west > east else [(west, east)]
+    for precision in range(PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows = range(floor((south + 90) / height), floor((min(north, 89.999999) + 90) / height) + 1)
+        columns = [range(floor((span_west + 180) / width), floor((min(span_east, 179.999999) + 180) / width) + 1)
+                   for span_west, span_east in spans]
+        # the halves can meet in one column; counting it twice only errs towards coarser cells
+        if len(rows) * sum(map(len, columns)) <= MAX_CELLS or precision == 1:
+            break
+    # encoding each cell's centre gives the cell's own prefix
+    return sorted({encode(-90 + (row + 0.5) * height, -180 + (column + 0.5) * width, precision)
+                   for row in rows for span in columns for column in span})
+
+
+def key_range(prefix):
+    # every geohash starting with prefix, as [low, high) under the C collation
+    return prefix, prefix + '{'
+
+
+def box_around(latitude, longitude, radius_km):
+    """Return (west, south, east, north) of a box holding the circle."""
+    delta_lat = degrees(radius_km / EARTH_RADIUS_KM)
+    south, north = max(latitude - delta_lat, -90.0), min(latitude + delta_lat, 90.0)
+    # the circle is widest at the latitude nearest a pole
+    widest = max(abs(south), abs(north))
+    if widest >= 89.9 or delta_lat / cos(radians(widest)) >= 180:
+        return -180.0, south, 180.0, north
+    delta_lng = delta_lat / cos(radians(widest))
+    west, east = longitude - delta_lng, longitude + delta_lng
+    if west < -180:
+        west += 360
+    if east > 180:
+        east -= 360
+    return west, south, east, north
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(radians, (lat1, lng1, lat2, lng2))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(sqrt(a))
+
+
+def place_key(name):
+    return ' '.join(name.casefold().split()) if name else ''
+
+
+class Gazetteer:
+    """City coordinates looked up by (city, state), or by city alone when it is unambiguous."""
+
+    def __init__(self, path):
+        self.places = {}
+        cities = {}
+        with open(path, newline='') as source:
+            for record in csv.DictReader(source):
+                city, state = place_key(record['city']), place_key(record.get('state'))
+                point = (float(record['latitude']), float(record['longitude']))
+                self.places.setdefault((city, state), point)
+                cities.setdefault(city, set()).add(point)
+        self.cities = {city: points.pop() for city, points in cities.items() if len(points) == 1}
+
+    def locate(self, city, state=None):
+        city = place_key(city)
+        return self.places.get((city, place_key(state))) or self.cities.get(city)
@@ -0,0 +1,165 @@
+from bisect import bisect_left
+from collections import defaultdict
+import threading
+import time
+
+from flask import g, has_request_context, request, request_finished, request_started
+from weakref import WeakSet
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+
+# Per-endpoint request latency, SQL query counts and rows fetched, exposed in
+# the Prometheus text format.
+#
+# Timing hangs off Flask's request_started/request_finished signals and the
+# SQL counts off SQLAlchemy's cursor events on every Engine, so replicas and
+# any other bind are covered too. Per-request tallies live on flask.g and are
+# folded into the shared totals once, when the request finishes.
+#
+# Each engine's pool is watched from its first connection on: checkout waits
+# go into a histogram, checkout timeouts are counted, and the pool's size,
+# checked out and overflow connections are read when /metrics is scraped.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250)
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield '{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, cumulative)
+        yield '{}_sum{{{}}} {}'.format(name, labels, self.sum)
+        yield '{}_count{{{}}} {}'.format(name, labels, cumulative)
+
+
+class Metrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.queries = defaultdict(lambda: Histogram(QUERY_BUCKETS))
+        self.rows = defaultdict(int)
+        self.pools = WeakSet()
+        self.pool_wait = defaultdict(lambda: Histogram(WAIT_BUCKETS))
+        self.pool_timeouts = defaultdict(int)
+
+    def init_app(self, app):
+        request_started.connect(self.request_started, app)
+        request_finished.connect(self.request_finished, app)
+        event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+        event.listen(Engine, 'engine_connect', self.engine_connect)
+        app.add_url_rule('/metrics', 'metrics', self.render)
+
+    def request_started(self, sender, **extra):
+        g.metrics_started = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_rows = 0
+
+    def request_finished(self, sender, response, **extra):
+        if 'metrics_started' not in g:
+            return
+        elapsed = time.perf_counter() - g.metrics_started
+        endpoint = request.endpoint or 'unmatched'
+        with self.lock:
+            self.latency[endpoint].observe(elapsed)
+            self.queries[endpoint].observe(g.metrics_queries)
+            self.rows[endpoint] += g.metrics_rows
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and 'metrics_queries' in g:
+            g.metrics_queries += 1
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and 'metrics_rows' in g and cursor.description is not None:
+            g.metrics_rows += max(cursor.rowcount, 0)
+
+    def engine_connect(self, connection, branch):
+        pool = connection.engine.pool
+        with self.lock:
+            if pool not in self.pools:
+                self.watch_pool(pool, repr(connection.engine.url))
+                self.pools.add(pool)
+
+    def watch_pool(self, pool, name):
+        """Time every checkout from pool, labelled with name."""
+        checkout = pool.connect
+
+        def timed_checkout():
+            started = time.perf_counter()
+            try:
+                return checkout()
+            except exc.TimeoutError:
+                with self.lock:
+                    self.pool_timeouts[name] += 1
+                raise
+            finally:
+                with self.lock:
+                    self.pool_wait[name].observe(time.perf_counter() - started)
+
+        pool.connect = timed_checkout
+        pool.metrics_name = name
+
+    def pool_gauges(self):
+        for pool in sorted(self.pools, key=lambda pool: pool.metrics_name):
+            # NullPool keeps nothing open, so it has no size to report
+            if hasattr(pool, 'checkedout'):
+                yield pool.metrics_name, pool.size(), pool.checkedout(), max(pool.overflow(), 0)
+
+    def render(self):
+        lines = [
+            '# HELP fyyur_request_duration_seconds Request latency by endpoint.',
+            '# TYPE fyyur_request_duration_seconds histogram',
+        ]
+        with self.lock:
+            for endpoint, histogram in sorted(self.latency.items()):
+                lines.extend(histogram.samples('fyyur_request_duration_seconds', 'endpoint="{}"'.format(endpoint)))
+            lines += [
+                '# HELP fyyur_request_sql_queries SQL statements issued per request.',
+                '# TYPE fyyur_request_sql_queries histogram',
+            ]
+            for endpoint, histogram in sorted(self.queries.items()):
+                lines.extend(histogram.samples('fyyur_request_sql_queries', 'endpoint="{}"'.format(endpoint)))
+            lines += [
+                '# HELP fyyur_sql_rows_fetched_total Rows returned by SELECTs.',
+                '# TYPE fyyur_sql_rows_fetched_total counter',
+            ]
+            for endpoint, rows in sorted(self.rows.items()):
+                lines.append('fyyur_sql_rows_fetched_total{{endpoint="{}"}} {}'.format(endpoint, rows))
+            lines += [
+                '# HELP fyyur_db_pool_wait_seconds Time spent waiting for a pooled connection.',
+                '# TYPE fyyur_db_pool_wait_seconds histogram',
+            ]
+            for name, histogram in sorted(self.pool_wait.items()):
+                lines.extend(histogram.samples('fyyur_db_pool_wait_seconds', 'pool="{}"'.format(name)))
+            lines += [
+                '# HELP fyyur_db_pool_timeouts_total Checkouts that gave up after pool_timeout.',
+                '# TYPE fyyur_db_pool_timeouts_total counter',
+            ]
+            for name, timeouts in sorted(self.pool_timeouts.items()):
+                lines.append('fyyur_db_pool_timeouts_total{{pool="{}"}} {}'.format(name, timeouts))
+            gauges = list(self.pool_gauges())
+        for metric, index, description in (('size', 1, 'Connections the pool keeps open.'),
+                                    ('checked_out', 2, 'Connections currently in use.'),
+                                    ('overflow', 3, 'Connections opened beyond pool_size.')):
+            lines += [
+                '# HELP fyyur_db_pool_{} {}'.format(metric, description),
+                '# TYPE fyyur_db_pool_{} gauge'.format(metric),
+            ]
+            for gauge in gauges:
+                lines.append('fyyur_db_pool_{}{{pool="{}"}} {}'.format(metric, gauge[0], gauge[index]))
+        return '\n'.join(lines) + '\n', 200, {'Content-Type': 'text/plain; version=0.0.4'}
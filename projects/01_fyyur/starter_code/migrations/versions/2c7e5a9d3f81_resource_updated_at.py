@@ -0,0 +1,26 @@
+"""updated_at on Venue and Artist for the API's Last-Modified
+
+Revision ID: 2c7e5a9d3f81
+Revises: f6a2c8d4b390
+Create Date: 2026-10-18 20:41:12.508317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2c7e5a9d3f81'
+down_revision = 'f6a2c8d4b390'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('Venue', sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False))
+    op.add_column('Artist', sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False))
+
+
+def downgrade():
+    op.drop_column('Artist', 'updated_at')
+    op.drop_column('Venue', 'updated_at')
@@ -0,0 +1,100 @@
+"""show end times, and no overlapping bookings of a venue or an artist
+
+Revision ID: 7b1f3d8e2a65
+Revises: 9d4b2e6f1c07
+Create Date: 2026-10-18 21:37:05.902215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b1f3d8e2a65'
+down_revision = '9d4b2e6f1c07'
+branch_labels = None
+depends_on = None
+
+
+# Does the job of EXCLUDE USING gist (venue_id WITH =, tsrange(start_time,
+# end_time) WITH &&) and the same for artist_id, without needing btree_gist.
+# A venue's shows never overlap each other, so of the shows starting before
+# NEW ends only the latest one can reach into NEW: checking a booking is one
+# backwards probe of ix_Show_venue_id_start_time (ix_Show_artist_id_start_time
+# for the artist). Locking the venue and artist rows serializes concurrent
+# bookings of the same venue or artist, so two of them cannot both pass.
+OVERLAP_TRIGGER = """
+CREATE FUNCTION show_no_overlap() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+  previous record;
+BEGIN
+  IF NEW.end_time IS NULL THEN
+    NEW.end_time := NEW.start_time + interval '2 hours';
+  END IF;
+  PERFORM 1 FROM "Venue" WHERE id = NEW.venue_id FOR NO KEY UPDATE;
+  PERFORM 1 FROM "Artist" WHERE id = NEW.artist_id FOR NO KEY UPDATE;
+
+  SELECT id, end_time INTO previous FROM "Show"
+    WHERE venue_id = NEW.venue_id AND start_time < NEW.end_time AND id <> NEW.id
+    ORDER BY start_time DESC LIMIT 1;
+  IF FOUND AND previous.end_time > NEW.start_time THEN
+    RAISE EXCEPTION 'venue % is already booked by show %', NEW.venue_id, previous.id
+      USING ERRCODE = 'exclusion_violation', CONSTRAINT = 'Show_venue_no_overlap';
+  END IF;
+
+  SELECT id, end_time INTO previous FROM "Show"
+    WHERE artist_id = NEW.artist_id AND start_time < NEW.end_time AND id <> NEW.id
+    ORDER BY start_time DESC LIMIT 1;
+  IF FOUND AND previous.end_time > NEW.start_time THEN
+    RAISE EXCEPTION 'artist % is already booked by show %', NEW.artist_id, previous.id
+      USING ERRCODE = 'exclusion_violation', CONSTRAINT = 'Show_artist_no_overlap';
+  END IF;
+  RETURN NEW;
+END
+$$;
+CREATE TRIGGER show_no_overlap BEFORE INSERT OR UPDATE OF venue_id, artist_id, start_time, end_time ON "Show"
+  FOR EACH ROW EXECUTE FUNCTION show_no_overlap();
+"""
+
+
+# The trigger only compares a booking with the show right before it, which is
+# enough as long as no two shows of a venue or an artist overlap already. Shows
+# booked before end times existed get two hours each, so check that they fit.
+OVERLAPS = """
+SELECT kind, previous_id, id FROM (
+  SELECT 'venue' AS kind, id, lag(id) OVER w AS previous_id, lag(end_time) OVER w AS previous_end, start_time
+    FROM "Show" WINDOW w AS (PARTITION BY venue_id ORDER BY start_time, id)
+  UNION ALL
+  SELECT 'artist', id, lag(id) OVER w, lag(end_time) OVER w, start_time
+    FROM "Show" WINDOW w AS (PARTITION BY artist_id ORDER BY start_time, id)
+) shows
+WHERE previous_end > start_time
+ORDER BY kind, previous_id
+LIMIT 20
+"""
+
+
+class OverlappingShows(Exception):
+    # not a RuntimeError: flask db would log that to a logger alembic.ini disables
+    pass
+
+
+def upgrade():
+    op.add_column('Show', sa.Column('end_time', sa.DateTime(), nullable=True))
+    op.execute('UPDATE "Show" SET end_time = start_time + interval \'2 hours\'')
+    overlaps = op.get_bind().execute(sa.text(OVERLAPS)).fetchall()
+    if overlaps:
+        raise OverlappingShows('shows overlap once they last two hours; move or delete one show of each pair '
+                               'and upgrade again:\n' + '\n'.join(
+                                   '  {} shows {} and {}'.format(kind, previous_id, show_id)
+                                   for kind, previous_id, show_id in overlaps))
+    op.alter_column('Show', 'end_time', nullable=False)
+    op.create_check_constraint('Show_end_after_start', 'Show', 'end_time > start_time')
+    op.execute(OVERLAP_TRIGGER)
+
+
+def downgrade():
+    op.execute('DROP TRIGGER show_no_overlap ON "Show"')
+    op.execute('DROP FUNCTION show_no_overlap()')
+    op.drop_constraint('Show_end_after_start', 'Show', type_='check')
+    op.drop_column('Show', 'end_time')
@@ -0,0 +1,24 @@
+"""index venue names for short search terms
+
+Revision ID: a3c5e8f1d276
+Revises: 7b1f3d8e2a65
+Create Date: 2026-10-19 09:12:44.381027
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c5e8f1d276'
+down_revision = '7b1f3d8e2a65'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Venue_name_id', 'Venue', ['name', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Venue_name_id', table_name='Venue')
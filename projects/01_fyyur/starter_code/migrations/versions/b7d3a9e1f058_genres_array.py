@@ -0,0 +1,40 @@
+"""store Venue and Artist genres as an indexed text array
+
+Revision ID: b7d3a9e1f058
+Revises: 5e2b7f0c1a94
+Create Date: 2026-10-18 12:31:44.105873
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d3a9e1f058'
+down_revision = '5e2b7f0c1a94'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # rows written from request.form.getlist('genres') hold the array literal
+    # psycopg2 produced for the list, e.g. '{Jazz,"Hip Hop"}'; anything else
+    # was typed in by hand and is treated as a comma separated list
+    for table in ('Venue', 'Artist'):
+        op.alter_column(table, 'genres',
+                        existing_type=sa.String(length=120),
+                        type_=postgresql.ARRAY(sa.String(length=120)),
+                        postgresql_using="CASE WHEN left(genres, 1) = '{' THEN genres::varchar(120)[] "
+                                         "ELSE array_remove(regexp_split_to_array(trim(genres), '\\s*,\\s*'), '') END")
+        op.create_index('ix_{}_genres'.format(table), table, ['genres'],
+                        unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    for table in ('Artist', 'Venue'):
+        op.drop_index('ix_{}_genres'.format(table), table_name=table)
+        op.alter_column(table, 'genres',
+                        existing_type=postgresql.ARRAY(sa.String(length=120)),
+                        type_=sa.String(length=120),
+                        postgresql_using='genres::varchar(120)')
@@ -0,0 +1,27 @@
+"""key the venue listing on coalesce(state, '')
+
+Revision ID: c8e2f4a6b913
+Revises: a3c5e8f1d276
+Create Date: 2026-10-19 09:41:17.550612
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8e2f4a6b913'
+down_revision = 'a3c5e8f1d276'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.drop_index('ix_Venue_state_city_name_id', table_name='Venue')
+    op.create_index('ix_Venue_state_city_name_id', 'Venue',
+                    [sa.text("coalesce(state, '')"), 'city', 'name', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Venue_state_city_name_id', table_name='Venue')
+    op.create_index('ix_Venue_state_city_name_id', 'Venue', ['state', 'city', 'name', 'id'], unique=False)
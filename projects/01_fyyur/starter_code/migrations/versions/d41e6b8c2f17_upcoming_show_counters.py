@@ -0,0 +1,96 @@
+"""maintained upcoming show counters on Venue and Artist
+
+Revision ID: d41e6b8c2f17
+Revises: b7d3a9e1f058
+Create Date: 2026-10-18 14:02:17.550921
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41e6b8c2f17'
+down_revision = 'b7d3a9e1f058'
+branch_labels = None
+depends_on = None
+
+
+# Statement level triggers with transition tables, so a COPY or bulk delete of
+# many shows costs one grouped UPDATE per table rather than one per row.
+COUNT_TRIGGER = """
+CREATE FUNCTION show_upcoming_counts() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    UPDATE "Venue" v SET num_upcoming_shows = v.num_upcoming_shows - c.n
+      FROM (SELECT venue_id, count(*) AS n FROM old_shows WHERE start_time > now() GROUP BY venue_id) c
+      WHERE v.id = c.venue_id;
+    UPDATE "Artist" a SET num_upcoming_shows = a.num_upcoming_shows - c.n
+      FROM (SELECT artist_id, count(*) AS n FROM old_shows WHERE start_time > now() GROUP BY artist_id) c
+      WHERE a.id = c.artist_id;
+  END IF;
+  IF TG_OP IN ('UPDATE', 'INSERT') THEN
+    UPDATE "Venue" v SET num_upcoming_shows = v.num_upcoming_shows + c.n
+      FROM (SELECT venue_id, count(*) AS n FROM new_shows WHERE start_time > now() GROUP BY venue_id) c
+      WHERE v.id = c.venue_id;
+    UPDATE "Artist" a SET num_upcoming_shows = a.num_upcoming_shows + c.n
+      FROM (SELECT artist_id, count(*) AS n FROM new_shows WHERE start_time > now() GROUP BY artist_id) c
+      WHERE a.id = c.artist_id;
+  END IF;
+  RETURN NULL;
+END
+$$;
+CREATE TRIGGER show_upcoming_counts_insert AFTER INSERT ON "Show"
+  REFERENCING NEW TABLE AS new_shows
+  FOR EACH STATEMENT EXECUTE FUNCTION show_upcoming_counts();
+CREATE TRIGGER show_upcoming_counts_update AFTER UPDATE ON "Show"
+  REFERENCING OLD TABLE AS old_shows NEW TABLE AS new_shows
+  FOR EACH STATEMENT EXECUTE FUNCTION show_upcoming_counts();
+CREATE TRIGGER show_upcoming_counts_delete AFTER DELETE ON "Show"
+  REFERENCING OLD TABLE AS old_shows
+  FOR EACH STATEMENT EXECUTE FUNCTION show_upcoming_counts();
+"""
+
+# Shows only ever move from upcoming to past as time passes, so only rows with
+# a non-zero counter can be out of date.
+REFRESH_FUNCTION = """
+CREATE FUNCTION refresh_upcoming_show_counts() RETURNS void LANGUAGE sql AS $$
+  UPDATE "Venue" v SET num_upcoming_shows = c.n
+    FROM (SELECT v.id, count(s.id) AS n FROM "Venue" v
+          LEFT JOIN "Show" s ON s.venue_id = v.id AND s.start_time > now()
+          WHERE v.num_upcoming_shows > 0 GROUP BY v.id) c
+    WHERE v.id = c.id AND v.num_upcoming_shows <> c.n;
+  UPDATE "Artist" a SET num_upcoming_shows = c.n
+    FROM (SELECT a.id, count(s.id) AS n FROM "Artist" a
+          LEFT JOIN "Show" s ON s.artist_id = a.id AND s.start_time > now()
+          WHERE a.num_upcoming_shows > 0 GROUP BY a.id) c
+    WHERE a.id = c.id AND a.num_upcoming_shows <> c.n;
+$$;
+"""
+
+
+def upgrade():
+    op.add_column('Venue', sa.Column('num_upcoming_shows', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('Artist', sa.Column('num_upcoming_shows', sa.Integer(), server_default='0', nullable=False))
+    op.execute("""
+        UPDATE "Venue" v SET num_upcoming_shows = c.n
+          FROM (SELECT venue_id, count(*) AS n FROM "Show" WHERE start_time > now() GROUP BY venue_id) c
+          WHERE v.id = c.venue_id
+    """)
+    op.execute("""
+        UPDATE "Artist" a SET num_upcoming_shows = c.n
+          FROM (SELECT artist_id, count(*) AS n FROM "Show" WHERE start_time > now() GROUP BY artist_id) c
+          WHERE a.id = c.artist_id
+    """)
+    op.execute(COUNT_TRIGGER)
+    op.execute(REFRESH_FUNCTION)
+
+
+def downgrade():
+    op.execute('DROP FUNCTION refresh_upcoming_show_counts()')
+    op.execute('DROP TRIGGER show_upcoming_counts_delete ON "Show"')
+    op.execute('DROP TRIGGER show_upcoming_counts_update ON "Show"')
+    op.execute('DROP TRIGGER show_upcoming_counts_insert ON "Show"')
+    op.execute('DROP FUNCTION show_upcoming_counts()')
+    op.drop_column('Artist', 'num_upcoming_shows')
+    op.drop_column('Venue', 'num_upcoming_shows')
@@ -0,0 +1,75 @@
+import random
+import time
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm
+
+# Read replica routing for the Flask-SQLAlchemy session.
+#
+# Every URI in SQLALCHEMY_REPLICA_URIS becomes a 'replica_<n>' bind. GET and
+# HEAD requests pick one replica for the whole request and read from it; any
+# other request, anything that flushes and anything outside a request (CLI
+# commands, migrations) uses the primary. A client that has just written is
+# pinned to the primary for READ_YOUR_WRITES_SECONDS, so a redirect after a
+# form post never reads from a replica that has not caught up yet. The pin is
+# a cookie of its own rather than a key in the signed session: SECRET_KEY is
+# generated per process, so another worker could not read the session and
+# would drop the pin.
+
+READ_METHODS = ('GET', 'HEAD')
+WRITE_COOKIE = 'fyyur_last_write'
+
+
+class RoutingSession(SignallingSession):
+
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        replica = g.get('replica_bind') if has_request_context() else None
+        if replica is None or self._flushing:
+            return super().get_bind(mapper, clause)
+        return self.db.get_engine(self.app, bind=replica)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def init_app(self, app):
+        replicas = app.config.get('SQLALCHEMY_REPLICA_URIS') or []
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        for index, uri in enumerate(replicas):
+            binds['replica_{}'.format(index)] = uri
+        app.config['SQLALCHEMY_BINDS'] = binds
+        self.replica_binds = ['replica_{}'.format(index) for index in range(len(replicas))]
+        super().init_app(app)
+        app.before_request(self.choose_bind)
+        app.after_request(self.remember_write)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def choose_bind(self):
+        g.replica_bind = None
+        if not self.replica_binds or request.method not in READ_METHODS:
+            return
+        try:
+            last_write = float(request.cookies.get(WRITE_COOKIE, 0))
+        except ValueError:
+            last_write = 0
+        # a timestamp from the future is ignored rather than pinning forever
+        if 0 <= time.time() - last_write < self.get_app().config['READ_YOUR_WRITES_SECONDS']:
+            return
+        g.replica_bind = random.choice(self.replica_binds)
+
+    def remember_write(self, response):
+        if self.replica_binds and request.method not in READ_METHODS:
+            seconds = self.get_app().config['READ_YOUR_WRITES_SECONDS']
+            response.set_cookie(WRITE_COOKIE, repr(time.time()), max_age=seconds, httponly=True, samesite='Lax')
+        return response
+
+
+def use_primary():
+    """Send the rest of this request's reads to the primary."""
+    g.replica_bind = None